@@ -0,0 +1,74 @@
+#!/usr/bin/python
+
+## Description: statuses of HTCondor jobs from the recorded user log data/4242.log
+## (submit, execute, evict, hold, release, abort, shadow exception and normal/abnormal
+## termination events, the last event being partially written), checked against the
+## expected ones, and cost of a read of a large user log by the EventLogTracker.
+
+import os
+import shutil
+import timeit
+import argparse
+
+import common
+from simprod.simjob.utils.HTCondorEventLog import EventLogTracker, parse_events
+
+RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "4242.log")
+
+EXPECTED = {0: "completed",  # normal termination, return value 0
+            1: "failed",     # normal termination, return value 1
+            2: "running",    # evicted and executing again
+            3: "failed",     # held
+            4: "submitted",  # held and released
+            5: "failed",     # aborted
+            6: "failed",     # abnormal termination
+            7: "submitted",  # shadow exception
+            8: "submitted"}  # executing, event not complete yet
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--ncopies", type=int, default=1000)
+parser.add_argument("--nrepeat", type=int, default=5)
+args = parser.parse_args()
+
+logdir = os.path.join(common.basedir, "logs")
+os.makedirs(logdir)
+logfile = os.path.join(logdir, "4242.log")
+shutil.copyfile(RECORDED, logfile)
+statefile = os.path.join(common.basedir, "htcondor_eventlogs.json")
+
+tracker = EventLogTracker(statefile, interval=0)
+tracker.watch(logfile)
+statuses = dict((n, tracker.status(4242, n)) for n in EXPECTED)
+assert statuses == EXPECTED, statuses
+
+# the rest of the partial event is written, only the new bytes are read
+with open(logfile, "a") as f:
+    f.write("...\n")
+offset = tracker.logs[logfile]["offset"]
+assert tracker.status(4242, 8) == "running"
+assert tracker.logs[logfile]["offset"] == os.path.getsize(logfile) > offset
+
+# a new session resumes from the state file, without reading the log again
+resumed = EventLogTracker(statefile, interval=0)
+assert resumed.read(logfile) == 0
+assert resumed.status(4242, 0) == "completed" and resumed.status(4242, 8) == "running"
+
+print("recorded log: {0} jobs with the expected statuses".format(len(EXPECTED)))
+
+with open(RECORDED, "r") as f:
+    text = f.read()
+biglog = os.path.join(logdir, "4243.log")
+with open(biglog, "w") as f:
+    for n in range(args.ncopies):
+        # the partial event of the recorded log is completed
+        f.write(text.replace("(4242.", "(4243.") + "...\n")
+nevents = len(parse_events(open(biglog).read()))
+
+def read():
+    bigtracker = EventLogTracker(None, interval=0)
+    bigtracker.watch(biglog)
+    return bigtracker.read(biglog)
+
+assert read() == nevents
+t = min(timeit.repeat(read, number=1, repeat=args.nrepeat))
+print("{0:>15}: {1:10.3f} ms for {2} events".format("log read", t * 1e3, nevents))
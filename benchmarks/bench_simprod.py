@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+## Description: timing of the hot paths of simprod on a synthetic database of njobs jobs
+## of nsubjobs subjobs: prepare(), send(), startup of a new session, loading of the jobs,
+## JobCollection.__str__, a full status refresh and remove(). The batch system is replaced
+## by a mock scheduler and the outputs of the subjobs are never looked up on disk, so that
+## only simprod itself is timed. The results are written as JSON.
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import subprocess
+from contextlib import contextmanager
+
+import common
+
+os.environ["SIMPROD_BACKEND"] = "local"
+
+EVTTYPE = 12345678
+NEVENTSJOB = 100
+RUNNUMBER = 1000000
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--njobs", type=int, default=20)
+parser.add_argument("--nsubjobs", type=int, default=100)
+parser.add_argument("--nsend", type=int, default=1,
+                    help="number of jobs sent with send(), the others are marked as submitted")
+parser.add_argument("--seed", type=int, default=1)
+parser.add_argument("--output", default=None, help="JSON file of the results (default stdout)")
+parser.add_argument("--startup", action="store_true", help=argparse.SUPPRESS)
+args = parser.parse_args()
+
+if args.startup:
+    # run in a new process by the benchmark to time the start of a session
+    start = time.time()
+    from simprod.simjob import JobCollection
+    JobCollection()
+    print(json.dumps({"seconds": time.time() - start}))
+    sys.exit(0)
+
+from simprod.simjob.simjob import JobCollection, SimulationJob, SimulationSubJob, DATABASE, STORAGE
+from simprod.simjob.utils import DeliveryClerk, Status
+
+
+class MockScheduler(object):
+    """
+    Batch system of the benchmark. At each advance, the submitted jobs start running and
+    the running ones finish, mostly successfully.
+    """
+
+    def __init__(self, seed):
+        self.jobs = {}
+        self.ncalls = 0
+        self.random = random.Random(seed)
+
+    def submit(self):
+        ID = len(self.jobs) + 1
+        self.jobs[ID] = "submitted"
+        return ID
+
+    def getstatus(self, ID):
+        self.ncalls += 1
+        return self.jobs.get(ID, "notfound")
+
+    def advance(self):
+        for ID, state in self.jobs.items():
+            if state == "submitted" and self.random.random() < 0.7:
+                self.jobs[ID] = "running"
+            elif state == "running":
+                self.jobs[ID] = "completed" if self.random.random() < 0.9 else "failed"
+
+
+scheduler = MockScheduler(args.seed)
+
+DeliveryClerk.send_subjob = lambda self, subjob: scheduler.submit()
+DeliveryClerk.getstatus = lambda self, ID: scheduler.getstatus(ID)
+DeliveryClerk.killsubjob = lambda self, ID: None
+SimulationSubJob.output = property(lambda self: "")
+
+results = {}
+
+@contextmanager
+def quiet():
+    devnull = open(os.devnull, "w")
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = devnull
+    try:
+        yield
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        devnull.close()
+
+def timed(name, func, nsubjobs):
+    ncalls = scheduler.ncalls
+    with quiet():
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+    results[name] = {"seconds": round(elapsed, 4),
+                     "ms_per_subjob": round(elapsed * 1e3 / max(nsubjobs, 1), 4),
+                     "getstatus_calls": scheduler.ncalls - ncalls}
+
+def expire(collection):
+    # the statuses are refreshed as if the last check was long ago
+    old = datetime.datetime.now() - datetime.timedelta(days=1)
+    for job in collection.jobs.values():
+        if job is None:
+            continue
+        for sj in job.subjobs.values():
+            if sj is not None:
+                sj._status.creation_time = old
+
+def mark_submitted(job):
+    with job.batch():
+        for sj in job:
+            sj.jobid = scheduler.submit()
+            sj._status = Status("submitted", "")
+            sj._update_subjob_table()
+    job.status
+
+nsubjobs = args.njobs * args.nsubjobs
+nsend = min(args.nsend, args.njobs)
+
+optdir = "{0}/EvtTypes/{1}".format(common.basedir, EVTTYPE)
+os.makedirs(optdir)
+open("{0}/{1}.py".format(optdir, EVTTYPE), "w").close()
+
+with quiet():
+    jobs = [SimulationJob(evttype=EVTTYPE, year=2016, simcond="Sim09h", neventsjob=NEVENTSJOB,
+                          nevents=args.nsubjobs * NEVENTSJOB, runnumber=RUNNUMBER + n * args.nsubjobs)
+            for n in range(args.njobs)]
+
+timed("prepare", lambda: [job.prepare() for job in jobs], nsubjobs)
+timed("send", lambda: [job.send() for job in jobs[:nsend]], nsend * args.nsubjobs)
+
+with quiet():
+    for job in jobs[nsend:]:
+        mark_submitted(job)
+    STORAGE.flush()
+    STORAGE.compact()
+
+command = [sys.executable, os.path.abspath(__file__), "--startup"]
+output = subprocess.check_output(command).decode("utf-8")
+results["startup"] = {"seconds": round(json.loads(output.strip().split("\n")[-1])["seconds"], 4)}
+
+scheduler.advance()
+
+collection = JobCollection()
+timed("str_unloaded", lambda: str(collection), nsubjobs)
+timed("load", lambda: list(collection), nsubjobs)
+expire(collection)
+timed("refresh", lambda: [job.status for job in collection.jobs.values() if job is not None], nsubjobs)
+timed("str", lambda: str(collection), nsubjobs)
+timed("remove", lambda: [job.remove() for job in list(collection)], nsubjobs)
+
+report = {"njobs": args.njobs, "nsubjobs": args.nsubjobs, "nsend": nsend,
+          "python": sys.version.split()[0], "results": results}
+
+if args.output:
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+else:
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+DATABASE.close()
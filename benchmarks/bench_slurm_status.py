@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+## Description: cost of a status refresh of the subjobs of a slurm job, one squeue per
+## subjob (as done before the StatusCache) compared to the bulk StatusCache, against the stand-in squeue and
+## sacct of benchmarks/bin.
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import common
+
+bindir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+os.environ["SIMPROD_BACKEND"] = "slurm"
+os.environ["SIMPROD_STANDIN_JOBS"] = "{0}/jobs.json".format(common.basedir)
+
+from simprod.simjob.utils import SlurmUtils
+
+STATES = ["PENDING", "RUNNING", "COMPLETED", "FAILED", "CANCELLED by 1234"]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--nsubjobs", type=int, default=500)
+args = parser.parse_args()
+
+IDs = [str(1000000 + n) for n in range(args.nsubjobs)]
+with open(os.environ["SIMPROD_STANDIN_JOBS"], "w") as f:
+    json.dump({ID: STATES[n % len(STATES)] for n, ID in enumerate(IDs)}, f)
+
+def ncalls():
+    callsfile = os.environ["SIMPROD_STANDIN_JOBS"] + ".calls"
+    if not os.path.isfile(callsfile):
+        return 0
+    with open(callsfile) as f:
+        n = len(f.readlines())
+    os.remove(callsfile)
+    return n
+
+def perjob():
+    return [subprocess.Popen(["squeue", "--job", ID, "-o", "%T"], stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE).communicate() for ID in IDs]
+
+def bulk():
+    cache = SlurmUtils.StatusCache()
+    cache.track(IDs)
+    return [cache.get(ID) for ID in IDs]
+
+print("{0} subjobs".format(args.nsubjobs))
+for name, func in [("squeue per subjob", perjob), ("bulk status", bulk)]:
+    ncalls()
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print("{0:>18}: {1:10.1f} ms, {2} commands".format(name, elapsed * 1e3, ncalls()))
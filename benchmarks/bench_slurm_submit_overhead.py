@@ -0,0 +1,60 @@
+#!/usr/bin/python
+
+## Description: per-subjob overhead of the slurm delivery clerk before sending a subjob
+## (options, send options and submission conditions), with the slurm config resolved at
+## every access as before and with the cached config. A site config module is written in
+## the temporary directory, as on the LPHE cluster, and the squeue stand-in of
+## benchmarks/bin is used for the submission conditions.
+
+import os
+import json
+import timeit
+import argparse
+
+import common
+
+bindir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+os.environ["SIMPROD_BACKEND"] = "slurm"
+os.environ["SIMPROD_STANDIN_JOBS"] = "{0}/jobs.json".format(common.basedir)
+
+from simprod.simjob.utils import SlurmUtils
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--nsubjobs", type=int, default=1000)
+parser.add_argument("--nrepeat", type=int, default=5)
+args = parser.parse_args()
+
+os.environ["HOSTNAME"] = "lphe-bench"
+SlurmUtils.SITECONFIG["file"] = "{0}/{1}.py".format(common.basedir, SlurmUtils.SITECONFIG["module"])
+SlurmUtils.SITECONFIG["dir"] = common.basedir
+with open(SlurmUtils.SITECONFIG["file"], "w") as f:
+    f.write("def config():\n")
+    f.write("    return {'nsimjobs': 500, 'nsimuserjobs': 150, 'nuserjobs': 200, 'npendingjobs': 50,\n")
+    f.write("            'nfreenodes': 0, 'nodestoexclude': [], 'cpumemory': 2800, 'totmemory': 4140,\n")
+    f.write("            'time': 20}\n")
+
+with open(os.environ["SIMPROD_STANDIN_JOBS"], "w") as f:
+    json.dump({str(n): "RUNNING" for n in range(50)}, f)
+
+clerk = SlurmUtils.DeliveryClerk()
+send_options = {"jobname": "2016_MagUp_1000evts_s28r1_123", "subdir": "simProd_12345678_sim09",
+                "loginprod": True}
+
+def subjob_overhead():
+    for n in range(args.nsubjobs):
+        options = clerk.options
+        clerk.new_send_options(send_options)
+        SlurmUtils.SubCondition(options)
+
+cached = SlurmUtils.DefaultSlurmOptions
+
+def uncached():
+    return SlurmUtils.GetConfig()
+
+print("{0} subjobs".format(args.nsubjobs))
+for name, provider in [("config per access", uncached), ("cached config", cached)]:
+    SlurmUtils.DefaultSlurmOptions = provider
+    t = min(timeit.repeat(subjob_overhead, number=1, repeat=args.nrepeat))
+    print("{0:>18}: {1:8.1f} us per subjob".format(name, t / args.nsubjobs * 1e6))
+SlurmUtils.DefaultSlurmOptions = cached
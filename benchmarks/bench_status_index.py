@@ -0,0 +1,49 @@
+#!/usr/bin/python
+
+## Description: cost of the "which jobs are still active" query of JobCollection._update
+## with the status index of the jobs table, compared to a full scan of the table.
+
+import timeit
+import argparse
+
+import common
+from tinydb import Query
+from simprod.simjob.utils.Database import SQLiteStorage, SQLiteDB
+
+STATUSES = ["new", "submitting", "submitted", "running", "completed", "failed"]
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--njobs", type=int, default=10000)
+parser.add_argument("--nrepeat", type=int, default=20)
+args = parser.parse_args()
+
+storage = SQLiteStorage("{0}/bench.db".format(common.basedir))
+database = SQLiteDB(storage)
+jobs = database.table("jobs")
+
+for n in range(args.njobs):
+    jobs.insert({"evttype": 12345678, "year": 2016, "nevents": 1000, "nsubjobs": 20,
+                 "status": STATUSES[n % len(STATUSES)]})
+storage.flush()
+
+condition = (Query().status == "new") | (Query().status == "submitting")
+condition = condition | (Query().status == "submitted")
+scan = Query().status.one_of(["new", "submitting", "submitted"])
+
+def lookup():
+    return jobs.lookup("status", "new", "submitting", "submitted")
+
+def search():
+    return jobs.search(condition)
+
+def fullscan():
+    return jobs.search(scan)
+
+assert lookup() == [d.doc_id for d in search()] == [d.doc_id for d in fullscan()]
+
+print("{0} jobs, {1} active".format(args.njobs, len(lookup())))
+for name, func in [("index lookup", lookup), ("indexed search", search), ("full scan", fullscan)]:
+    t = min(timeit.repeat(func, number=1, repeat=args.nrepeat))
+    print("{0:>15}: {1:10.3f} ms".format(name, t * 1e3))
+
+database.close()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+## Description: offline stand-in for the batch system commands (squeue, sacct, bjobs,
+## sbatch). The jobs are read from the json file $SIMPROD_STANDIN_JOBS, {jobid: state},
+## and every call is appended to $SIMPROD_STANDIN_JOBS.calls so that the number of forked
+## commands can be counted.
+
+import os
+import sys
+import json
+import getpass
+
+QUEUED = ["PENDING", "RUNNING", "COMPLETING", "CONFIGURING"]
+
+def jobs():
+    with open(os.environ["SIMPROD_STANDIN_JOBS"]) as f:
+        return json.load(f)
+
+def log(argv):
+    with open(os.environ["SIMPROD_STANDIN_JOBS"] + ".calls", "a") as f:
+        f.write(" ".join(argv) + "\n")
+
+def option(argv, name, default=None):
+    if name in argv:
+        return argv[argv.index(name) + 1]
+    return default
+
+def squeue(argv):
+    states = jobs()
+    ID = option(argv, "--job")
+    if ID is not None:
+        if states.get(ID) not in QUEUED:
+            sys.stderr.write("slurm_load_jobs error: Invalid job id specified\n")
+            return 1
+        print("STATE")
+        print("'" + states[ID])
+        return 0
+    user = getpass.getuser()
+    fields = option(argv, "-o", "%i %T").split()
+    if "-h" not in argv:
+        print("JOBID STATE")
+    for ID, state in sorted(states.items()):
+        if state in QUEUED and ("-u" not in argv or option(argv, "-u") == user):
+            values = {"%i": ID, "%T": state, "%u": user, "%j": "simProd_standin"}
+            print(" ".join(values[f] for f in fields))
+    return 0
+
+def bjobs(argv):
+    states = jobs()
+    IDs = [a for a in argv if a.isdigit()]
+    if "-u" in argv:
+        IDs = sorted(states)
+    for ID in IDs:
+        if ID in states:
+            print("{0} {1}".format(ID, states[ID]))
+        else:
+            sys.stderr.write("Job <{0}> is not found\n".format(ID))
+    return 0
+
+def sbatch(argv):
+    with open(os.environ["SIMPROD_STANDIN_JOBS"] + ".calls") as f:
+        print("Submitted batch job {0}".format(5000000 + len(f.readlines())))
+    return 0
+
+def sacct(argv):
+    states = jobs()
+    for ID in option(argv, "-j", "").split(","):
+        if ID in states:
+            print("{0}|{1}".format(ID, states[ID]))
+    return 0
+
+if __name__ == "__main__":
+    command = os.path.basename(sys.argv[0])
+    log([command] + sys.argv[1:])
+    sys.exit({"squeue": squeue, "sacct": sacct, "bjobs": bjobs, "sbatch": sbatch}[command](sys.argv[1:]))
@@ -0,0 +1,24 @@
+#!/usr/bin/python
+
+## Description: helpers for the benchmarks, the simprod modules are loaded with
+## SIMPRODPATH and SIMOUTPUT pointing to a temporary directory so that the benchmarks
+## never touch the production database.
+
+import os
+import sys
+import types
+import tempfile
+
+# a benchmark started by another one, e.g. to time a new session, shares its directory
+basedir = os.getenv("SIMPROD_BENCH_DIR") or tempfile.mkdtemp(prefix="simprod_bench_")
+os.environ["SIMPROD_BENCH_DIR"] = basedir
+
+os.environ["SIMPRODPATH"] = basedir
+os.environ["SIMOUTPUT"] = basedir + "/SimulationJobs"
+os.environ.setdefault("HOSTNAME", "localhost")
+
+# the simprod package __init__ is generated at installation with the production paths,
+# it is skipped and only the package path is registered
+simprod = types.ModuleType("simprod")
+simprod.__path__ = [os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "simprod")]
+sys.modules["simprod"] = simprod
@@ -6,16 +6,24 @@
 ## Description: simulation job class
 
 import os
+import sys
 import time
+import traceback
+import threading
 from random import randint, shuffle
 import warnings
 import glob
+from contextlib import contextmanager
 from tqdm import tqdm
 from colorama import Fore
 
 from .setup import DoProd, checksiminputs
 from .utils import *
 from .utils.Database import getdatabase
+from .utils.Profiling import ENABLED as PROFILING, profiler, record
+from .utils.Inventory import FileInventory
+from .utils.MoveJobs import CLEANUP
+from .utils.Status import RefreshPolicy
 
 from tinydb import Query
     
@@ -23,49 +31,31 @@ DATABASE, STORAGE = getdatabase()
 
 DEBUG = 0
 
-TIME_NEW = 20 #minutes, time between check of status if status is new
-TIME_RUNNING = 5
-TIME_FAILED = 5
-TIME_SUBMITTED = 1
+REFRESH_INTERVAL = 120 #seconds between two background refreshes of the jobs
+
+# held by the shell while it runs a command and by the background refresher while it
+# refreshes a job, the jobs and the database are only touched by one of them at a time
+LOCK = threading.RLock()
 
 class JobCollection(object):
     """
-    Simulation job collection.
+    Simulation job collection. The jobs are loaded lazily, a SimulationJob is only
+    instantiated when accessed, until then it is shown from its document in the database.
     """
     
     def __init__(self, **kwargs):
         
-        simprod = os.getenv("SIMPRODPATH")+"/simprod"		
         self.jobs = {}
         
-        jobs = self.jobcollection
-        
         if IsHTCondor():
             self.htcondor = True
-            self.scheduler = Scheduler()
+            self.scheduler = getscheduler()
             self.cwargs = {"scheduler": self.scheduler}
         else:
             self.htcondor = False
             self.cwargs = {"scheduler": None}
 
-        if len(jobs) > 0:	
-                        
-            print(red("\nLoading Jobs:"))
-            t = tqdm(total=len(jobs))
-            
-            for k in self.keys:
-                
-                job_k = self.jobcollection.get(doc_id=k)
-                
-                if job_k["status"] == "completed":
-                    self.jobs[k] = None
-                else:
-                    self.jobs[k] = SimulationJob.from_doc(job_k, **self.cwargs)
-                    
-                t.update(1)
-                
-            t.close()
-            
+        self.refresher = Refresher(self)
 
         self._update(in_init = True)
         
@@ -75,14 +65,20 @@ class JobCollection(object):
 
     @property
     def keys(self):
-        return sorted([j.doc_id for j in self.jobcollection.all()], key=int)
+        return self.jobcollection.ids()
         
     def __str__(self):
         
         if DEBUG > 1:
             print("In JobCollection.__str__")
         
-        self._update()
+        # with the background refresher, the jobs are shown as last stored in the database
+        refreshing = self.refresher.isalive
+        
+        if not refreshing:
+            self._update()
+        
+        docs = {doc.doc_id: doc for doc in self.jobcollection.all()}
 
         toprint = []		
         toprint.append("{0} jobs".format(len(self.jobs)))
@@ -106,10 +102,10 @@ class JobCollection(object):
         toprint.append(header)
         toprint.append(line)
             
-        for k in self.keys:
-            job = self.jobs[k]
+        for k in sorted(docs.keys()):
+            job = self.jobs.get(k, None)
                 
-            if job is not None:
+            if job is not None and not refreshing:
                 status  = job.status
                 evttype = job.evttype
                 year    = job.year
@@ -124,7 +120,7 @@ class JobCollection(object):
                     ncompleted = len(job.select("completed"))    
                     nfailed = len(job.select("failed"))            
             else:
-                job_doc = self.jobcollection.get(doc_id=k)
+                job_doc = docs[k]
                 status  = job_doc["status"]
                 evttype = job_doc["evttype"]
                 year    = job_doc["year"]
@@ -172,6 +168,9 @@ class JobCollection(object):
             linejob = "|".join(tojoin) + "|"
                         
             toprint.append(color(linejob))
+            
+        if refreshing:
+            toprint.append(self.refresher.lastupdated())
                 
         toprint = "\n".join(toprint)
         
@@ -186,18 +185,42 @@ class JobCollection(object):
             return
         p.text(self.__str__())
         
+    def profile(self, dumpfile=None, reset=False):
+        """
+        Prints the time spent in the batch system commands, database flushes, file probes
+        and file moves since the start (or the last reset), and writes it as JSON in dumpfile
+        if given. The instrumentation is enabled with the environment variable SIMPROD_PROFILE.
+        """
+        if not PROFILING:
+            print(red("Profiling is disabled, start simprod with SIMPROD_PROFILE=1 to enable it."))
+            return
+            
+        print(profiler.summary())
+        
+        if dumpfile is not None:
+            profiler.dump(dumpfile)
+            print(blue("Profile written in {0}.".format(dumpfile)))
+            
+        if reset:
+            profiler.reset()
+        
     def __geti__(self, i, printlevel = 1):
+        
+        with LOCK:
+            return self.__load(i, printlevel)
+            
+    def __load(self, i, printlevel):
 
         if i not in self.keys and i > max(self.keys):
             self._update()
         if i not in self.keys:
             raise ValueError("job {0} not found!".format(i))
         else:
-            if self.jobs[i] is None:
+            if self.jobs.get(i, None) is None:
                 if printlevel > 0:
                     print(green("Loading Job {0}:".format(i)))
                 job_i_doc = self.jobcollection.get(doc_id=i)
-                job_i = SimulationJob.from_doc(job_i_doc,  **self.cwargs)
+                job_i = SimulationJob.from_doc(job_i_doc, printlevel = printlevel, **self.cwargs)
                 self.jobs[i] = job_i
                 
         return self.jobs[i]
@@ -221,42 +244,50 @@ class JobCollection(object):
         if DEBUG > 0:
             print("In JobCollection._udpate")
         
-        if len(self.jobcollection) > 0:
-            condition = (Query().status == "new") | (Query().status == "submitting")
-            condition = condition | (Query().status == "submitted")
-            to_update = self.jobcollection.search(condition)
-        else:
-            to_update = []        
-
-
-        for j in to_update:
-            if j.doc_id not in self.jobs.keys():
-                self.jobs[j.doc_id] = SimulationJob.from_doc(j, **self.cwargs)
-            elif len(self.jobs[j.doc_id].subjobs) == 0:
-                self.jobs[j.doc_id] = SimulationJob.from_doc(j, **self.cwargs)
-            else:
-                self.jobs[j.doc_id]._update_job_table(True)
+        with LOCK:
+            self.__update()
+            
+        if DEBUG > 0:
+            print("Out of JobCollection._udpate")
+            
+    def __update(self):
+            
+        store_moves()
+        
+        keys = self.keys
         
-        if len(self.jobs) > len(self.keys):
-            for k in self.jobs.keys():
-                if k not in self.keys:
+        for k in keys:
+            if k not in self.jobs:
+                self.jobs[k] = None
+                
+        if len(self.jobs) > len(keys):
+            keyset = set(keys)
+            for k in list(self.jobs.keys()):
+                if k not in keyset:
                     del self.jobs[k]
+        
+        to_update = self.jobcollection.lookup("status", "new", "submitting", "submitted")
 
-        for k in self.keys:
+        for k in to_update:
+            job = self.jobs[k]
+            if job is None:
+                continue
+            elif len(job.subjobs) == 0:
+                self.jobs[k] = SimulationJob.from_doc(self.jobcollection.get(doc_id=k), **self.cwargs)
+            else:
+                job._update_job_table(True)
+
+        for k in keys:
             if DEBUG > 0:
                 print("In JobCollection._udpate, keys={}".format(k))   
             
-            job_doc = self.jobcollection.get(doc_id=k)
-            
-            if k not in self.jobs.keys():
-                job = SimulationJob.from_doc(job_doc, **self.cwargs)
-                self.jobs[k] = job
-            else:
-                job = self.jobs[k]
+            job = self.jobs[k]
             
             if job is None:
                 continue
             
+            job_doc = self.jobcollection.get(doc_id=k)
+            
             status = job.last_status
             if status != job_doc["status"]:
                 _dict = dict(status = status)
@@ -265,8 +296,142 @@ class JobCollection(object):
             if status in ["completed", "failed"]:
                 self.jobs[k] = None
 
-        if DEBUG > 0:
-            print("Out of JobCollection._udpate")
+
+class RefresherOutput(object):
+    """
+    Stream writing the output of the refresher thread in a log file, so that it does not
+    overwrite the prompt, and the output of the other threads in the original stream.
+    """
+    
+    def __init__(self, stream, log, thread):
+        self.stream = stream
+        self.log = log
+        self.thread = thread
+        
+    def _target(self):
+        if threading.current_thread() is self.thread:
+            return self.log
+        else:
+            return self.stream
+        
+    def write(self, data):
+        return self._target().write(data)
+        
+    def flush(self):
+        self._target().flush()
+        
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class Refresher(object):
+    """
+    Refreshes the status of the active jobs of a collection in a background thread, every
+    `interval` seconds, and stores it in the database. LOCK is held while a job is loaded
+    and refreshed, and released between two jobs. The output of the refresher is written in
+    $SIMPRODPATH/refresher.log, its errors are reported after the next command.
+    """
+    
+    running = set()
+    
+    def __init__(self, collection, interval=REFRESH_INTERVAL):
+        self.collection = collection
+        self.interval = interval
+        self.last_updated = None
+        self.logfile = "{0}/refresher.log".format(os.getenv("SIMPRODPATH"))
+        self.errors = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._log = None
+        self._streams = None
+        
+    @property
+    def isalive(self):
+        return self._thread is not None and self._thread.is_alive()
+        
+    def start(self, interval=None):
+        if interval is not None:
+            self.interval = interval
+        if self.isalive:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="simprod-refresher")
+        self._thread.daemon = True
+        
+        self._log = open(self.logfile, "a")
+        self._streams = sys.stdout, sys.stderr
+        sys.stdout = RefresherOutput(sys.stdout, self._log, self._thread)
+        sys.stderr = RefresherOutput(sys.stderr, self._log, self._thread)
+        
+        self._thread.start()
+        Refresher.running.add(self)
+        
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        Refresher.running.discard(self)
+        
+        if self._streams is not None:
+            sys.stdout, sys.stderr = self._streams
+            self._streams = None
+            self._log.close()
+            self._log = None
+            
+    def lastupdated(self):
+        if self.last_updated is None:
+            return "refreshing in the background, not updated yet"
+        else:
+            return "last updated: {0}".format(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.last_updated)))
+            
+    def report(self):
+        """
+        Prints the errors of the background refreshes since the last report, called by the
+        shell after a command so that the prompt is not overwritten.
+        """
+        errors, self.errors = self.errors, []
+        for err in errors:
+            print(red("WARNING\tbackground refresh of the jobs failed: {0}, see {1}".format(err, self.logfile)))
+            
+    def _run(self):
+        while not self._stop.is_set():
+            print("{0} refreshing the jobs".format(time.strftime("%Y-%m-%d %H:%M:%S")))
+            try:
+                self.refresh()
+            except Exception as err:
+                traceback.print_exc()
+                # an error repeated at each refresh is reported once
+                if str(err) not in self.errors:
+                    self.errors.append(str(err))
+            sys.stdout.flush()
+            self._stop.wait(self.interval)
+            
+    def refresh(self):
+        collection = self.collection
+        
+        with LOCK:
+            collection._update()
+            active = collection.jobcollection.lookup("status", "submitting", "submitted", "running")
+            if collection.htcondor:
+                collection.scheduler.invalidate()
+        
+        for k in sorted(active):
+            if self._stop.is_set():
+                return
+            with LOCK:
+                try:
+                    job = collection.__geti__(k, printlevel = -1)
+                except ValueError:
+                    # removed by a command in the meantime
+                    continue
+                job.deliveryclerk.track(sj.jobid for sj in job.subjobs.values() if sj is not None)
+                job.status
+                
+        with LOCK:
+            collection._update()
+            
+        self.last_updated = time.time()
 
 
 class SimulationJob(object):
@@ -277,6 +442,10 @@ class SimulationJob(object):
     def __init__(self, **kwargs):		
         self.subjobs = {}
         self._options = {}
+        self._batch = None
+        self.inventory = FileInventory()
+        self._refresh = None
+        self._counts = None
         
         self.nevents = kwargs.get('nevents', None)
         if self.nevents is None:
@@ -313,7 +482,7 @@ class SimulationJob(object):
         
         self.htcondor = False
         
-        if IsSlurm():
+        if IsSlurm() or IsLocal():
             self._options["loginprod"] = True
             
         elif IsHTCondor() or IsLSF():
@@ -330,7 +499,7 @@ class SimulationJob(object):
         if IsHTCondor():
             self.htcondor = True
             if self.scheduler is None:
-                self.scheduler = Scheduler()
+                self.scheduler = getscheduler()
        
         self.deliveryclerk = DeliveryClerk(inscreen=self._inscreen, scheduler=self.scheduler)
         
@@ -357,7 +526,62 @@ class SimulationJob(object):
     @property
     def jobtable(self):
         return self.database.table("job_{}".format(self.jobnumber))
+        
+    @contextmanager
+    def batch(self):
+        """
+        Collects the updates of the subjobs documents and stores them in one transaction, with
+        one flush, at the end of the block.
+        """
+        if self._batch is not None:
+            yield
+            return
+            
+        self._batch = {}
+        try:
+            yield
+        finally:
+            batch, self._batch = self._batch, None
+            if len(batch) > 0:
+                self.jobtable.bulk_update(batch)
+                self.database.storage.flush()
+                
+    def _store_subjob(self, sjn, fields):
+        if self._batch is not None:
+            self._batch.setdefault(sjn, {}).update(fields)
+        else:
+            self.jobtable.update(fields, doc_ids=[sjn])
+            
+    def _subjob_doc(self, sjn):
+        sj_doc = self.jobtable.get(doc_id=sjn)
+        if sj_doc is not None and self._batch is not None and sjn in self._batch:
+            sj_doc.update(self._batch[sjn])
+        return sj_doc
+
+    def _moving(self, sjn, sj_doc):
+        """
+        True if the outputs of a completed subjob are not yet at their destination, their moves
+        are pending or have failed. Failed moves are queued again.
+        """
+        if getmover().ismoving((self.jobnumber, sjn)):
+            return True
+        moves = sj_doc.get("moves") or []
+        if any(move["error"] is not None for move in moves):
+            self[sjn]._move_jobs()
+            return True
+        return False
 
+    @property
+    def refresh(self):
+        """
+        Policy of the status checks of the subjobs, the run times of the completed subjobs
+        are read from the database the first time.
+        """
+        if self._refresh is None:
+            runtimes = [doc["runtime"] for doc in self.jobtable.all() if doc.get("runtime") is not None]
+            self._refresh = RefreshPolicy(maxruntime=self.deliveryclerk.maxruntime, runtimes=runtimes)
+        return self._refresh
+            
     @property
     def range_subjobs(self):
         for n in xrange(self.nsubjobs):
@@ -639,11 +863,12 @@ class SimulationJob(object):
                                                                         
         infiles = kwargs.get('infiles', [])
                 
-        for n in self.range_subjobs:				
-            if self.subjobs.get(n, None) is not None:
-                continue
-                
-            self._preparesubjobs(n, infiles=infiles)
+        with self.database.storage.transaction():
+            for n in self.range_subjobs:				
+                if self.subjobs.get(n, None) is not None:
+                    continue
+                    
+                self._preparesubjobs(n, infiles=infiles)
             
         if update_table:
             self._update_job_table(update_subjobs=True)
@@ -774,6 +999,10 @@ class SimulationJob(object):
             
         if len(self.keys) == 0:
             return "new"    
+            
+        # new refresh cycle, the directories of the job are listed again
+        self.inventory.clear([self.proddir, self.destdir])
+        store_moves()
         
         if self.last_status == "new":
             self._update_job_table(True)
@@ -786,46 +1015,57 @@ class SimulationJob(object):
             nfailed    = 0
             
             keys = self.keys
-                                                            
-            for n in self.range_subjobs:
-                
-                if n in keys:
-                    sj_doc = self.jobtable.get(doc_id=n)
-                    subjob = self.subjobs[n]
-                
-                    if subjob is None:
-                        status = sj_doc["status"]
-                    else:
-                        status = subjob.status
-                        jobid  = subjob.jobid
-                        
-                        _dict = {}
-                        
-                        if sj_doc["jobid"] != jobid:
-                            _dict["jobid"] = jobid
-                        if sj_doc["status"] != status:
-                            _dict["status"] = status
+            
+            with record("track"):
+                self.deliveryclerk.track(sj.jobid for sj in self.subjobs.values() if sj is not None)
+            
+            # read once per refresh, the options of the batch system may have changed
+            self.refresh.maxruntime = self.deliveryclerk.maxruntime
+            
+            with self.batch():
+                for n in self.range_subjobs:
+                    
+                    if n in keys:
+                        sj_doc = self._subjob_doc(n)
+                        subjob = self.subjobs[n]
+                    
+                        if subjob is None:
+                            status = sj_doc["status"]
+                        else:
+                            status = subjob.status
+                            jobid  = subjob.jobid
                             
-                        if len(_dict) > 0:
-                            self.jobtable.update(_dict, doc_ids=[n])
-                        
-                        if status in ["completed", "failed"]:
-                            self[n] = None
-                        
-                else:
-                    status = "new"
+                            _dict = {}
+                            
+                            if sj_doc["jobid"] != jobid:
+                                _dict["jobid"] = jobid
+                            if sj_doc["status"] != status:
+                                _dict["status"] = status
                                 
-                if status == "submitted":
-                    nsubmitted += 1
-                elif status == "running":
-                    nrunning   += 1
-                    nsubmitted += 1
-                elif status == "completed":
-                    ncompleted += 1
-                    nsubmitted += 1
-                elif status == "failed":
-                    nfailed    += 1
-                    nsubmitted += 1
+                            if len(_dict) > 0:
+                                self._store_subjob(n, _dict)
+                            
+                            if status in ["completed", "failed"]:
+                                self[n] = None
+                            
+                    else:
+                        status = "new"
+                        
+                    if status == "completed" and self._moving(n, sj_doc):
+                        # the job is not completed before the outputs are at their destination
+                        status = "running"
+                                    
+                    if status == "submitted":
+                        nsubmitted += 1
+                    elif status == "running":
+                        nrunning   += 1
+                        nsubmitted += 1
+                    elif status == "completed":
+                        ncompleted += 1
+                        nsubmitted += 1
+                    elif status == "failed":
+                        nfailed    += 1
+                        nsubmitted += 1
 
             if nsubmitted == 0:
                 _status = "new"	
@@ -845,6 +1085,12 @@ class SimulationJob(object):
                 
             if _status == "completed":
                 self.deliveryclerk.clear(self)
+                
+            counts = {"nrunning": nrunning, "ncompleted": ncompleted, "nfailed": nfailed}
+            if counts != self._counts and self.jobnumber is not None:
+                # shown by the collection without loading the subjobs
+                self.database.table("jobs").update(counts, doc_ids=[self.jobnumber])
+                self._counts = counts
                                 
             if _status != self._status:
                 info_msg = "INFO\tstatus of job {0} changed from '{1}' to '{2}'"
@@ -933,44 +1179,48 @@ class SimulationJob(object):
                 print("in SimulationJob._update_job_table, update subjobs")
             table = self.deliveryclerk.get_update_subjobs(self)
                                 
-            for n in self.range_subjobs:
+            with self.batch():
+                for n in self.range_subjobs:
                 
-                job = self[n]
+                    job = self[n]
                 
-                if job.status == "new" and isinstance(job.jobid, int):
-                    job._status = Status("submitted", job.output)
-                    continue
+                    if job.status == "new" and isinstance(job.jobid, int):
+                        job._status = Status("submitted", job.output, inventory=job.inventory)
+                        continue
                 
-                if job._status.isvalid and not job.status == "submitted":
-                    continue
+                    if job._status.isvalid and not job.status == "submitted":
+                        continue
                 
-                if job.status  == "completed":
-                    continue
+                    if job.status  == "completed":
+                        continue
                     
-                else:
-                    if table is not None:
-                        doc = table.get(Query().subjobnumber == n)
-                        if DEBUG > 0:
-                            print(n, doc)
                     else:
-                        doc = None
+                        if table is not None:
+                            doc = table.get(n, None)
+                            if DEBUG > 0:
+                                print(n, doc)
+                        else:
+                            doc = None
                     
-                    if doc is not None:
-                        if DEBUG > 0:
-                            print(n, doc["runnumber"], self.getrunnumber(n))
-                        assert doc["runnumber"] == self.getrunnumber(n)
-                        _dict = {}
+                        if doc is not None:
+                            if DEBUG > 0:
+                                print(n, doc["runnumber"], self.getrunnumber(n))
+                            assert doc["runnumber"] == self.getrunnumber(n)
+                            _dict = {}
                         
-                        if doc["jobid"] != job.jobid:
-                            job.jobid = doc["jobid"]
-                        if doc["status"] != job.status and job.status == "new":
-                            job._status = Status(doc["status"], job.output)
+                            if doc["jobid"] != job.jobid:
+                                job.jobid = doc["jobid"]
+                            if doc["status"] != job.status and job.status == "new":
+                                job._status = Status(doc["status"], job.output, inventory=job.inventory)
                             
-                        if doc["status"] != "new" and doc["jobid"] is not None:
-                            job._status.submitted = True
+                            if doc["status"] != "new" and doc["jobid"] is not None:
+                                job._status.submitted = True
                             
-                    else:
-                        job._update_subjob_table()
+                            # stored with its jobid, the row of the queue is then dropped
+                            job._update_subjob_table()
+                            
+                        else:
+                            job._update_subjob_table()
  
         if DEBUG > 0:
             print("Out of SimulationJob._update_job_table, jobnumber:{0}".format(self.jobnumber))
@@ -1031,7 +1281,8 @@ class SimulationJob(object):
             else:
                 t = None
             
-            simjob.subjobs = {n:simjob._load_subjob(n, t, printlevel) for n in simjob.range_subjobs}
+            with simjob.batch():
+                simjob.subjobs = {n:simjob._load_subjob(n, t, printlevel) for n in simjob.range_subjobs}
                                                                 
             if printlevel > 0:																		
                 t.close()
@@ -1051,7 +1302,7 @@ class SimulationJob(object):
         
     def _load_subjob( self, nsj, pbar = None, printlevel = 0, force_load = False ):
                 
-        sj_doc = self.jobtable.get(doc_id=nsj)
+        sj_doc = self._subjob_doc(nsj)
         
         if sj_doc is not None:
             status = sj_doc["status"]
@@ -1097,60 +1348,64 @@ class SimulationJob(object):
             toprint.append(header)
             toprint.append(line)
 
-            for n in self.range_subjobs:
+            # with the background refresher, the subjobs are shown as last stored
+            refreshing = isrefreshing()
+            
+            with self.batch():
+                for n in self.range_subjobs:
                 
-                sj_doc = self.jobtable.get(doc_id=n)
+                    sj_doc = self._subjob_doc(n)
                 
-                if self.subjobs[n] is None:
-                    status    = sj_doc["status"] 
-                    jobID     = sj_doc["jobid"]
-                    runnumber = self.getrunnumber(n)
-                    polarity  = sj_doc["polarity"]
-                else:				
-                    job = self[n]				
-                    status    = job.status
-                    jobID     = job.jobid
-                    runnumber = job.runnumber
-                    polarity  = job.polarity
+                    if self.subjobs[n] is None or refreshing:
+                        status    = sj_doc["status"] 
+                        jobID     = sj_doc["jobid"]
+                        runnumber = self.getrunnumber(n)
+                        polarity  = sj_doc["polarity"]
+                    else:				
+                        job = self[n]				
+                        status    = job.status
+                        jobID     = job.jobid
+                        runnumber = job.runnumber
+                        polarity  = job.polarity
                     
-                    _dict = {}
+                        _dict = {}
                     
-                    if sj_doc["jobid"] != job.jobid:
-                        _dict["jobid"] = job.jobid
-                    if sj_doc["status"] != job.status:
-                        _dict["status"] = job.status
+                        if sj_doc["jobid"] != job.jobid:
+                            _dict["jobid"] = job.jobid
+                        if sj_doc["status"] != job.status:
+                            _dict["status"] = job.status
                         
-                    if len(_dict) > 0:
-                        self.jobtable.update( _dict, doc_ids=[n])
+                        if len(_dict) > 0:
+                            self._store_subjob(n, _dict)
                         
-                nevents   = self.neventsjob
+                    nevents   = self.neventsjob
                 
-                if status == "submitted":
-                    color = cyan
-                elif status == "new":
-                    color = cdefault
-                elif status == "running":
-                    color = green
-                elif status == "completed":
-                    color = blue
-                elif status == "failed":
-                    color = red
+                    if status == "submitted":
+                        color = cyan
+                    elif status == "new":
+                        color = cdefault
+                    elif status == "running":
+                        color = green
+                    elif status == "completed":
+                        color = blue
+                    elif status == "failed":
+                        color = red
                         
-                p_job       = "{n:{fill}{al}{w}} ".format(w=(len(h_job)-1), al='>', fill='', n=n)
+                    p_job       = "{n:{fill}{al}{w}} ".format(w=(len(h_job)-1), al='>', fill='', n=n)
                 
-                p_jobID     = "{n:{fill}{al}{w}} ".format(w=(len(h_jobID)-1), al='>', fill='', n=jobID)
+                    p_jobID     = "{n:{fill}{al}{w}} ".format(w=(len(h_jobID)-1), al='>', fill='', n=jobID)
                 
-                p_status    = "{n:{fill}{al}{w}} ".format(w=(len(h_status)-1), al='>', fill='', n=status)
+                    p_status    = "{n:{fill}{al}{w}} ".format(w=(len(h_status)-1), al='>', fill='', n=status)
                 
-                p_runnumber = "{n:{fill}{al}{w}} ".format(w=(len(h_runnumber)-1), al='>', fill='', n=runnumber)
+                    p_runnumber = "{n:{fill}{al}{w}} ".format(w=(len(h_runnumber)-1), al='>', fill='', n=runnumber)
                 
-                p_polarity  = "{n:{fill}{al}{w}} ".format(w=(len(h_polarity)-1), al='>', fill='', n=polarity)
+                    p_polarity  = "{n:{fill}{al}{w}} ".format(w=(len(h_polarity)-1), al='>', fill='', n=polarity)
                 
-                p_nevents   = "{n:{fill}{al}{w}} ".format(w=(len(h_nevents)-1), al='>', fill='', n=nevents)
+                    p_nevents   = "{n:{fill}{al}{w}} ".format(w=(len(h_nevents)-1), al='>', fill='', n=nevents)
                 
-                linejob = "|".join([p_job, p_jobID, p_status, p_runnumber, p_polarity, p_nevents]) + "|"
+                    linejob = "|".join([p_job, p_jobID, p_status, p_runnumber, p_polarity, p_nevents]) + "|"
                 
-                toprint.append(color(linejob))
+                    toprint.append(color(linejob))
                 
             toprint = "\n".join(toprint)
             
@@ -1180,6 +1435,8 @@ class SimulationSubJob(object):
         self.runnumber = runnumber
         self.subjobnumber = subjobnumber
         self.jobid = None
+        self.started = None #time when the subjob was first seen running
+        self.runtime = None #minutes
         self.send_options = self.parent.options.copy()
         self._infiles = kwargs.get("infiles", [])
         self.send_options["infiles"] = self._infiles
@@ -1215,7 +1472,7 @@ class SimulationSubJob(object):
             self.logjobdir = "{0}/{1}".format(self.send_options["logdestdir"],
                                               self.jobname)
         
-        self._status = Status(status="new", output=self.output)
+        self._status = Status(status="new", output=self.output, inventory=self.inventory)
         
         if kwargs.get("newsubjob", True):
             self.parenttable.insert(self.outdict())
@@ -1228,6 +1485,10 @@ class SimulationSubJob(object):
     @property
     def parenttable(self):
         return self.parent.jobtable
+        
+    @property
+    def inventory(self):
+        return self.parent.inventory
                
     @property
     def infiles(self):
@@ -1252,7 +1513,7 @@ class SimulationSubJob(object):
             self.jobid = self.parent.deliveryclerk.send_subjob(self)
             
             if self.jobid:
-                self._status = Status("submitted", self.output)
+                self._status = Status("submitted", self.output, inventory=self.inventory)
                             
                 time.sleep(0.07)
                 print(blue("{0}/{1} jobs submitted!".format(int(self.subjobnumber), self.parent.nsubjobs)))
@@ -1288,9 +1549,11 @@ class SimulationSubJob(object):
                 if not self._status.isvalid:
                     if DEBUG > 0:
                         toprint += " C"
-                    status = self.parent.deliveryclerk.getstatus(self.jobid)
+                    with record("getstatus"):
+                        status = self.parent.deliveryclerk.getstatus(self.jobid)
                     if status != "error":
-                        self._status = Status(status, self.output)
+                        self._status = Status(status, self.output, inventory=self.inventory)
+                        self._time_status()
                     
             if DEBUG > 0:
                 print(toprint)
@@ -1319,12 +1582,27 @@ class SimulationSubJob(object):
                 
         return repr(self._status)
         
+    def _time_status(self):
+        # the run time is counted from the first check where the subjob is running
+        now = time.time()
+        elapsed = None
+        
+        if self._status.running and self.started is None:
+            self.started = now
+        elif self._status.completed and self.started is not None and self.runtime is None:
+            self.runtime = (now - self.started) / 60.
+            self.parent.refresh.addruntime(self.runtime)
+            
+        if self.started is not None:
+            elapsed = (now - self.started) / 60.
+            
+        self._status.ttl = self.parent.refresh.ttl(self._status.status, elapsed)
                                                 
     @property
     def output(self):
-        if os.path.isfile(self.prodfile):
+        if self.inventory.isfile(self.prodfile):
             return self.prodfile
-        elif os.path.isfile(self.destfile):
+        elif self.inventory.isfile(self.destfile):
             return self.destfile	
         else:
             return ""
@@ -1336,7 +1614,9 @@ class SimulationSubJob(object):
             
         self._empty_proddir()
         self.jobid = None
-        self._status = Status("new", self.output)
+        self.started = None
+        self.runtime = None
+        self._status = Status("new", self.output, inventory=self.inventory)
         self._update_subjob_table()
             
     def command(self):
@@ -1369,7 +1649,7 @@ class SimulationSubJob(object):
             if self._status.submitted:
                 self.parent.deliveryclerk.killsubjob(self.jobid)
                 
-        self._status = Status("failed", self.output)
+        self._status = Status("failed", self.output, inventory=self.inventory)
         self._update_subjob_table()
         if storeparent:
             self.parent._update_job_table()
@@ -1389,6 +1669,7 @@ class SimulationSubJob(object):
                         os.remove(f) 
             else:
                 silentrm(self.jobdir)
+            self.inventory.invalidate(self.jobdir, self.parent.proddir)
                 
         if not self.send_options["loginprod"] and not keep_log:
             if os.path.isdir(self.logjobdir):
@@ -1396,19 +1677,19 @@ class SimulationSubJob(object):
                 
     def _move_jobs(self):
         
-        if not os.path.isdir(self.jobdir):
+        if not self.inventory.isdir(self.jobdir):
             msg = " WARNING: production folder has been removed, if the jobs is marked as"
             msg += "failed the output hasbeen probably lost!"
             warnings.warn(red(msg), stacklevel=2)
             
         else:
+            mover = getmover()
+            key = (self.parent.jobnumber, self.subjobnumber)
+            
+            if mover.ismoving(key):
+                return
+            
             dst_prodfile = self.prodfile
-
-            if "eos" in dst_prodfile:
-                mover = EosMove
-            else:
-                mover = Move
-                    
             xml_prodfile = os.path.dirname(dst_prodfile) + "/GeneratorLog.xml"
             dst_destfile = self.destfile
             xml_destfile = os.path.dirname(self.destfile) + "/xml/{0}.xml".format(self.runnumber)
@@ -1426,20 +1707,29 @@ class SimulationSubJob(object):
                     
             print(info_msg)
             
-            if os.path.isfile(dst_prodfile):
-                mover(dst_prodfile, dst_destfile)
+            moves = []
+            
+            if self.inventory.isfile(dst_prodfile):
+                moves.append((dst_prodfile, dst_destfile))
             else:
                 warn_msg = red("WARNING\tdst output is not found. It has probably been moved or erased manually")
                 print(warn_msg)
                 
             if self.keepxml:		
-                if os.path.isfile(xml_prodfile):
-                    mover(xml_prodfile, xml_destfile)
+                if self.inventory.isfile(xml_prodfile):
+                    moves.append((xml_prodfile, xml_destfile))
                 else:
                     warn_msg = red("WARNING\tGeneratorLog.xml is not found. It has probably been moved or erased manually")
                     print(warn_msg)
+                    
+            keep_log = self.keeplog
+                    
+            def cleanup():
+                # run by the mover once the outputs are at their destination
+                self.inventory.invalidate(os.path.dirname(dst_destfile), os.path.dirname(xml_destfile))
+                self._empty_proddir(keep_log)
                 
-            self._empty_proddir(self.keeplog)
+            mover.submit(key, moves, cleanup)
            
          
     def outdict(self):
@@ -1449,7 +1739,9 @@ class SimulationSubJob(object):
                "polarity": self.polarity,
                "jobid": self.jobid,
                "status": repr(self._status),
-               "infiles": self.infiles
+               "infiles": self.infiles,
+               "started": self.started,
+               "runtime": self.runtime
                }
             
         if DEBUG > 0:
@@ -1464,7 +1756,7 @@ class SimulationSubJob(object):
                     
     def _update_subjob_table(self):
         
-        self.parenttable.update(self.outdict(), Query().runnumber == self.runnumber)
+        self.parent._store_subjob(self.subjobnumber, self.outdict())
                           
 
     @classmethod
@@ -1482,12 +1774,14 @@ class SimulationSubJob(object):
             print("In SimulationSubJob.from_dict, subjob={0}.".format(subjobnumber))
                         
         simsubjob.jobid = dict["jobid"]
+        simsubjob.started = dict.get("started")
+        simsubjob.runtime = dict.get("runtime")
         simsubjob.infiles = dict.get("infiles",[])
         simsubjob.send_options["infiles"] = dict.get("infiles",[])
         
         status = dict["status"]
         
-        simsubjob._status = Status(status, simsubjob.output, in_init=True)
+        simsubjob._status = Status(status, simsubjob.output, in_init=True, inventory=simsubjob.inventory)
                             
         if not simsubjob.send_options["loginprod"]:
             simsubjob.logjobdir = dict["logjobdir"]
@@ -1508,6 +1802,34 @@ class SimulationSubJob(object):
                 
 # utilities
 
+def isrefreshing():
+    """
+    True if the jobs are refreshed by a background refresher.
+    """
+    return any(refresher.isalive for refresher in Refresher.running)
+
+def store_moves():
+    """
+    Stores in the subjob documents the results of the output moves done in the background
+    since the last call, with the adler32 checksums of the copied files. The subjobs with a
+    failed move are moved again at the next refresh of their job.
+    """
+    for (jobnumber, subjobnumber), results in getmover().collect().items():
+        if jobnumber is None:
+            continue
+        
+        moves = []
+        for destination, result in sorted(results.items()):
+            if result["error"] is not None and destination == CLEANUP:
+                warn_msg = "WARNING\tcleanup of subjob {0}.{1} after the move of its outputs failed: {2}"
+                print(red(warn_msg.format(jobnumber, subjobnumber, result["error"])))
+            elif result["error"] is not None:
+                warn_msg = "WARNING\tmove of the output of subjob {0}.{1} to {2} failed: {3}"
+                print(red(warn_msg.format(jobnumber, subjobnumber, destination, result["error"])))
+            moves.append({"file": destination, "error": result["error"], "adler32": result["adler32"]})
+        
+        DATABASE.table("job_{}".format(jobnumber)).update({"moves": moves}, doc_ids=[subjobnumber])
+
 
 
 
@@ -2,12 +2,13 @@
 
 import os
 import json as js
+import sqlite3
+import threading
 import pyparsing
-
-from tinydb import JSONStorage, TinyDB
-from tinydb.middlewares import CachingMiddleware
+from contextlib import contextmanager
 
 from .utilities import red, blue
+from .Profiling import profiled
 
 Suppress = pyparsing.Suppress
 Word = pyparsing.Word
@@ -16,8 +17,31 @@ alphas = pyparsing.alphas
 number = Word(pyparsing.nums)
 OneOrMore = pyparsing.OneOrMore
 
-simprod = os.getenv("SIMPRODPATH")	
+simprod = os.getenv("SIMPRODPATH")
 jobsfile = "{0}/simjobs.json".format(simprod)
+dbfile = "{0}/simjobs.db".format(simprod)
+
+BUSY_TIMEOUT = 30 #seconds, time a write waits for the lock held by another session
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    doc_id INTEGER PRIMARY KEY,
+    status TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status);
+
+CREATE TABLE IF NOT EXISTS subjobs (
+    job INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    runnumber INTEGER,
+    status TEXT,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (job, doc_id)
+);
+CREATE INDEX IF NOT EXISTS subjobs_runnumber ON subjobs (job, runnumber);
+CREATE INDEX IF NOT EXISTS subjobs_status ON subjobs (job, status);
+"""
 
 
 class CorruptedDB(Exception):
@@ -25,26 +49,498 @@ class CorruptedDB(Exception):
     pass
 
 
+class Document(dict):
+    """A stored document, i.e. a dict which knows its doc_id (as in TinyDB)."""
+
+    def __init__(self, value, doc_id):
+        super(Document, self).__init__(value)
+        self.doc_id = doc_id
+
+
+class SQLiteStorage(object):
+    """
+    Holds the sqlite3 connection, in WAL mode: a write appends the changed pages to the
+    write-ahead log, which sqlite copies into the database file at its checkpoints and
+    replays when the database is opened after a crash, and the other sessions keep reading
+    while this one writes. Every write is committed at once, except in a `transaction`
+    block whose writes are committed together at its end (or after WRITE_CACHE_SIZE
+    writes), so that no lock on the database is kept open between two writes.
+    """
+
+    WRITE_CACHE_SIZE = 600
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+        # not available on some network filesystems, sqlite then keeps its rollback journal
+        mode = self.connection.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        self.wal = mode.lower() == "wal"
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._depth = 0
+        self._cache_modified_count = 0
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            self.connection.execute(sql, params)
+
+    def executemany(self, sql, seq_params):
+        with self.lock:
+            self.connection.executemany(sql, seq_params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        The writes of the block are committed together at its end.
+        """
+        with self.lock:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.flush()
+
+    def written(self, nwrites=1):
+        with self.lock:
+            self._cache_modified_count += nwrites
+            if self._depth == 0 or self._cache_modified_count >= self.WRITE_CACHE_SIZE:
+                self.connection.commit()
+                self._cache_modified_count = 0
+
+    @profiled("flush")
+    def flush(self):
+        with self.lock:
+            self.connection.commit()
+            self._cache_modified_count = 0
+
+    @profiled("compact")
+    def compact(self):
+        with self.lock:
+            self.flush()
+            if self.wal:
+                # copies the WAL into the database file, without waiting for the readers
+                self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.compact()
+                self.connection.close()
+                self.connection = None
+
+
+class SQLiteTable(object):
+    """
+    Table stored in sqlite with the subset of the TinyDB table API used by simprod.
+    The documents are stored as JSON, the `indexed` fields are also stored in their
+    own (indexed) columns. Queries made of `==` conditions on indexed fields are run
+    in sql, the other ones by scanning the table.
+
+    For the `memindexed` fields a secondary index value -> set of doc_ids is also
+    kept in memory and maintained on every write, so that a query on these fields
+    is a dictionary lookup.
+    """
+
+    def __init__(self, storage, name, sqltable, indexed, key=None, memindexed=()):
+        self.name = name
+        self._storage = storage
+        self._sqltable = sqltable
+        self._indexed = indexed
+        self._memindexed = memindexed
+
+        if key is None:
+            self._keycolumns = ()
+            self._keyvalues = ()
+        else:
+            self._keycolumns = (key[0],)
+            self._keyvalues = (key[1],)
+
+        self._last_id = self._select("MAX(doc_id)")[0][0] or 0
+
+        self._memindex = {}
+        self._memvalues = {}
+        for f in self._memindexed:
+            self._memindex[f] = {}
+            self._memvalues[f] = {}
+            for doc_id, value in self._select("doc_id, {0}".format(f)):
+                self._memindex[f].setdefault(value, set()).add(doc_id)
+                self._memvalues[f][doc_id] = value
+
+    def _where(self, condition="", params=()):
+        clauses = ["{0} = ?".format(c) for c in self._keycolumns]
+        if condition:
+            clauses.append(condition)
+        if clauses:
+            where = " WHERE " + " AND ".join(clauses)
+        else:
+            where = ""
+        return where, self._keyvalues + tuple(params)
+
+    def _select(self, columns, condition="", params=(), order=""):
+        where, params = self._where(condition, params)
+        sql = "SELECT {0} FROM {1}{2}".format(columns, self._sqltable, where)
+        if order:
+            sql += " ORDER BY " + order
+        return self._storage.query(sql, params)
+
+    def _indexvalues(self, doc):
+        return tuple(doc.get(f, None) for f in self._indexed)
+
+    def _memindex_add(self, doc_id, doc):
+        for f in self._memindexed:
+            value = doc.get(f, None)
+            previous = self._memvalues[f].get(doc_id, None)
+            if doc_id in self._memvalues[f]:
+                if previous == value:
+                    continue
+                self._memindex[f][previous].discard(doc_id)
+            self._memindex[f].setdefault(value, set()).add(doc_id)
+            self._memvalues[f][doc_id] = value
+
+    def _memindex_remove(self, doc_id):
+        for f in self._memindexed:
+            if doc_id in self._memvalues[f]:
+                value = self._memvalues[f].pop(doc_id)
+                self._memindex[f][value].discard(doc_id)
+
+    def _memcondition(self, hashval):
+        # set of doc_ids matching the hash of a TinyDB query, None if not possible
+        if not isinstance(hashval, tuple) or len(hashval) < 2:
+            return None
+        op = hashval[0]
+        if op == "==" and len(hashval) == 3:
+            path, value = hashval[1], hashval[2]
+            if len(path) != 1 or path[0] not in self._memindexed:
+                return None
+            return set(self._memindex[path[0]].get(value, ()))
+        elif op in ["and", "or"]:
+            ids = None
+            for h in hashval[1]:
+                matched = self._memcondition(h)
+                if matched is None:
+                    return None
+                if ids is None:
+                    ids = matched
+                elif op == "and":
+                    ids &= matched
+                else:
+                    ids |= matched
+            return ids
+        else:
+            return None
+
+    def lookup(self, field, *values):
+        """
+        Sorted doc_ids of the documents with `field` in `values`, `field` must be
+        in the memory index.
+        """
+        ids = set()
+        for value in values:
+            ids |= self._memindex[field].get(value, set())
+        return sorted(ids)
+
+    def _sqlcondition(self, hashval):
+        # translate the hash of a TinyDB query into sql, None if not possible
+        if not isinstance(hashval, tuple) or len(hashval) < 2:
+            return None
+        op = hashval[0]
+        if op == "==" and len(hashval) == 3:
+            path, value = hashval[1], hashval[2]
+            if len(path) != 1 or path[0] not in self._indexed:
+                return None
+            if value is None:
+                return "{0} IS NULL".format(path[0]), ()
+            if isinstance(value, (tuple, list, dict, frozenset)):
+                return None
+            return "{0} = ?".format(path[0]), (value,)
+        elif op in ["and", "or"]:
+            clauses, params = [], ()
+            for h in hashval[1]:
+                translated = self._sqlcondition(h)
+                if translated is None:
+                    return None
+                clauses.append("({0})".format(translated[0]))
+                params += translated[1]
+            return " {0} ".format(op.upper()).join(clauses), params
+        else:
+            return None
+
+    def _documents(self, cond=None):
+        translated = None
+        if cond is not None:
+            hashval = getattr(cond, "_hash", getattr(cond, "hashval", None))
+            ids = self._memcondition(hashval)
+            if ids is not None:
+                for doc in self._documents_byid(sorted(ids)):
+                    if cond(doc):
+                        yield doc
+                return
+            translated = self._sqlcondition(hashval)
+
+        if translated is None:
+            rows = self._select("doc_id, doc", order="doc_id")
+        else:
+            rows = self._select("doc_id, doc", translated[0], translated[1], order="doc_id")
+
+        for doc_id, doc in rows:
+            doc = Document(js.loads(doc), doc_id)
+            if cond is None or cond(doc):
+                yield doc
+
+    def _documents_byid(self, doc_ids, chunksize=500):
+        for i in range(0, len(doc_ids), chunksize):
+            chunk = doc_ids[i:i+chunksize]
+            condition = "doc_id IN ({0})".format(", ".join("?" for _ in chunk))
+            for doc_id, doc in self._select("doc_id, doc", condition, chunk, order="doc_id"):
+                yield Document(js.loads(doc), doc_id)
+
+    def _write(self, docs):
+        sql = "UPDATE {0} SET {1}, doc = ?".format(self._sqltable,
+                                                    ", ".join("{0} = ?".format(f) for f in self._indexed))
+        where, params = self._where("doc_id = ?")
+        self._storage.executemany(sql + where, [self._indexvalues(doc) + (js.dumps(doc),) + params + (doc.doc_id,)
+                                                for doc in docs])
+        for doc in docs:
+            self._memindex_add(doc.doc_id, doc)
+
+    def insert(self, doc):
+        return self._insert(self._last_id + 1, doc)
+
+    def _insert(self, doc_id, doc):
+        columns = self._keycolumns + ("doc_id",) + self._indexed + ("doc",)
+        values = self._keyvalues + (doc_id,) + self._indexvalues(doc) + (js.dumps(doc),)
+        sql = "INSERT INTO {0} ({1}) VALUES ({2})".format(self._sqltable, ", ".join(columns),
+                                                          ", ".join("?" for c in columns))
+        self._storage.execute(sql, values)
+        self._storage.written()
+        self._memindex_add(doc_id, doc)
+        self._last_id = max(self._last_id, doc_id)
+        return doc_id
+
+    def insert_multiple(self, docs):
+        return [self.insert(doc) for doc in docs]
+
+    def get(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            rows = self._select("doc", "doc_id = ?", (doc_id,))
+            if len(rows) == 0:
+                return None
+            return Document(js.loads(rows[0][0]), doc_id)
+
+        for doc in self._documents(cond):
+            return doc
+        return None
+
+    def contains(self, cond=None, doc_ids=None):
+        if doc_ids is not None:
+            return any(self.get(doc_id=i) is not None for i in doc_ids)
+        return self.get(cond) is not None
+
+    def all(self):
+        return list(self._documents())
+
+    def ids(self):
+        return [row[0] for row in self._select("doc_id", order="doc_id")]
+
+    def search(self, cond):
+        return list(self._documents(cond))
+
+    def count(self, cond):
+        return len(self.search(cond))
+
+    def update(self, fields, cond=None, doc_ids=None):
+        if doc_ids is not None:
+            docs = [self.get(doc_id=i) for i in doc_ids]
+            docs = [d for d in docs if d is not None]
+        else:
+            docs = list(self._documents(cond))
+
+        return self._update([(doc, fields) for doc in docs])
+
+    def bulk_update(self, updates):
+        """
+        Applies all the updates {doc_id: fields} in one transaction, returns the
+        updated doc_ids.
+        """
+        with self._storage.lock:
+            docs = self._documents_byid(sorted(updates.keys()))
+            return self._update([(doc, updates[doc.doc_id]) for doc in docs])
+
+    def _update(self, updates):
+        updated = []
+        towrite = []
+        with self._storage.lock:
+            for doc, fields in updates:
+                old = dict(doc)
+                if callable(fields):
+                    fields(doc)
+                else:
+                    doc.update(fields)
+
+                changes = dict((k, v) for k, v in doc.items() if k not in old or old[k] != v)
+                if len(changes) > 0:
+                    towrite.append(doc)
+                updated.append(doc.doc_id)
+
+            if len(towrite) > 0:
+                self._write(towrite)
+                self._storage.written(len(towrite))
+
+        return updated
+
+    def upsert(self, doc, cond=None, doc_id=None):
+        if doc_id is not None:
+            updated = self.update(doc, doc_ids=[doc_id])
+        else:
+            updated = self.update(doc, cond)
+        if updated:
+            return updated
+        if doc_id is not None:
+            return [self._insert(doc_id, doc)]
+        return [self.insert(doc)]
+
+    def remove(self, cond=None, doc_ids=None):
+        if doc_ids is None:
+            doc_ids = [d.doc_id for d in self._documents(cond)]
+
+        where, params = self._where("doc_id = ?")
+        sql = "DELETE FROM {0}{1}".format(self._sqltable, where)
+        self._storage.executemany(sql, [params + (i,) for i in doc_ids])
+        self._storage.written(len(doc_ids))
+        for i in doc_ids:
+            self._memindex_remove(i)
+        return list(doc_ids)
+
+    def purge(self):
+        where, params = self._where()
+        self._storage.execute("DELETE FROM {0}{1}".format(self._sqltable, where), params)
+        self._storage.written()
+        self._last_id = 0
+        for f in self._memindexed:
+            self._memindex[f] = {}
+            self._memvalues[f] = {}
+
+    def __len__(self):
+        return self._select("COUNT(*)")[0][0]
+
+    def __iter__(self):
+        for doc in self._documents():
+            yield doc
+
+
+class SQLiteDB(object):
+    """
+    Job database stored in sqlite. The `jobs` table is stored in the jobs sql table
+    and the `job_N` tables of subjobs in the subjobs sql table.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._tables = {}
+
+    def table(self, name):
+        if name in self._tables:
+            return self._tables[name]
+
+        if name == "jobs":
+            table = SQLiteTable(self.storage, name, "jobs", ("status",), memindexed=("status",))
+        elif name.startswith("job_"):
+            table = SQLiteTable(self.storage, name, "subjobs", ("runnumber", "status"),
+                                key=("job", int(name.replace("job_", ""))))
+        else:
+            raise ValueError("Unknown table {0}!".format(name))
+
+        self._tables[name] = table
+        return table
+
+    def tables(self):
+        names = set()
+        if len(self.table("jobs")) > 0:
+            names.add("jobs")
+        for row in self.storage.query("SELECT DISTINCT job FROM subjobs"):
+            names.add("job_{0}".format(row[0]))
+        return names
+
+    def purge_table(self, name):
+        self.table(name).purge()
+        del self._tables[name]
+
+    def close(self):
+        self.storage.close()
+
+
 def getdatabase():
-    
+
+    if not os.path.isfile(dbfile) and os.path.isfile(jobsfile):
+        migrate(jobsfile, dbfile)
+
+    storage = SQLiteStorage(dbfile)
+    database = SQLiteDB(storage)
+
+    return database, storage
+
+
+def loadjson(jsfile):
+
     for ntry in range(3):
         try:
-            storage = CachingMiddleware(JSONStorage)
-            storage.WRITE_CACHE_SIZE = 600
-            db = TinyDB(jobsfile, storage=storage), storage
+            with open(jsfile, "r") as f:
+                content = js.load(f)
             if ntry > 0:
                 print(blue("The database was successfully fixed."))
-            return db
+            return content
         except ValueError:
             if ntry == 0:
                 print(blue("The database is corrupted. Attempting to fix it."))
-            debug_json(jobsfile)
+            debug_json(jsfile)
     else:
         msg = "The database coulnd't be fixed. Please open an issue in https://github.com/marinang/SimProd/issues"
         msg += " with the 'simjobs.json' file attached."
         raise CorruptedDB(red(msg))
 
 
+def migrate(jsfile, sqlfile):
+    """
+    One-shot migration of a TinyDB json database into a sqlite database.
+    """
+
+    print(blue("Migrating the database {0} to {1}.".format(jsfile, sqlfile)))
+
+    content = loadjson(jsfile)
+
+    tmpfile = sqlfile + ".tmp"
+    if os.path.isfile(tmpfile):
+        os.remove(tmpfile)
+
+    storage = SQLiteStorage(tmpfile)
+
+    jobs = content.get("jobs", {})
+    storage.executemany("INSERT INTO jobs (doc_id, status, doc) VALUES (?, ?, ?)",
+                        [(int(k), d.get("status", None), js.dumps(d)) for k, d in jobs.items()])
+
+    for name, table in content.items():
+        if not name.startswith("job_"):
+            continue
+        jobnumber = int(name.replace("job_", ""))
+        sql = "INSERT INTO subjobs (job, doc_id, runnumber, status, doc) VALUES (?, ?, ?, ?, ?)"
+        storage.executemany(sql, [(jobnumber, int(k), d.get("runnumber", None), d.get("status", None),
+                                   js.dumps(d)) for k, d in table.items()])
+
+    storage.close()
+    os.rename(tmpfile, sqlfile)
+
+    print(blue("{0} jobs migrated.".format(len(jobs))))
+
+    return sqlfile
+
+
 def debug_json(jsfile):
 
     with open(jsfile, "r") as f:
@@ -70,7 +566,7 @@ def debug_json(jsfile):
                 new_lines.append(l[0: parsed_error_msg["column"]])
             else:
                 new_lines.append(l)
-                
+
         with open(jsfile, "w") as f:
             f.writelines(new_lines)
 
@@ -78,7 +574,7 @@ def debug_json(jsfile):
         pass
 
     return jsfile
-        
-            
-        
-    
\ No newline at end of file
+
+
+
+
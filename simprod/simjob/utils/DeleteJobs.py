@@ -0,0 +1,254 @@
+#!/usr/bin/python
+
+## Description: removal of the production and log directories of the subjobs, done in the
+## background by a pool of threads. A directory is first renamed aside, so that its path can
+## be reused at once, and then removed with scandir. The directories on EOS which cannot be
+## removed through the FUSE mount are removed in batches by one eos command. The directories
+## left renamed aside by a session which was killed are removed by the next one.
+
+import os
+import re
+import time
+import errno
+import socket
+import shutil
+import tempfile
+import threading
+from subprocess import Popen, PIPE
+
+from .Profiling import record
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		# python 2 without the scandir backport, the trees are removed by shutil
+		scandir = None
+
+try:
+	from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+	# python 2 without the futures backport, the removals are done synchronously
+	ThreadPoolExecutor = None
+
+DELETER_THREADS = 4
+EOS_BATCH = 100 #directories removed by one eos command
+
+# .{name}.deleted.{host}.{pid}.{count}
+TRASH = re.compile(r"^\..+\.deleted\.(?P<host>[^.]+)\.(?P<pid>\d+)\.\d+$")
+
+def logfile():
+	return "{0}/deleter.log".format(os.getenv("SIMPRODPATH"))
+	
+def hostname():
+	return socket.gethostname().split(".")[0]
+	
+def isalive( pid ):
+	try:
+		os.kill(pid, 0)
+	except OSError as err:
+		# EPERM: the process exists but belongs to another user
+		return err.errno == errno.EPERM
+	return True
+
+def RemoveTree( path ):
+	"""
+	Removes a file or a directory tree, errors are ignored as with rm -rf.
+	"""
+	if scandir is None:
+		if os.path.isdir(path) and not os.path.islink(path):
+			shutil.rmtree(path, ignore_errors = True)
+		elif os.path.lexists(path):
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+		return
+
+	try:
+		entries = list(scandir(path))
+	except OSError:
+		# not a directory
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+		return
+
+	for entry in entries:
+		if entry.is_dir(follow_symlinks=False):
+			RemoveTree(entry.path)
+		else:
+			try:
+				os.remove(entry.path)
+			except OSError:
+				pass
+
+	try:
+		os.rmdir(path)
+	except OSError:
+		pass
+
+def EosRemove( paths ):
+	"""
+	Removes the directories on EOS with one eos session, the commands are read from a script.
+	"""
+	fd, script = tempfile.mkstemp(suffix=".eosh")
+	with os.fdopen(fd, "w") as f:
+		for path in paths:
+			f.write("rm -rF {0}\n".format(path))
+
+	try:
+		P = Popen(['eos', '-b', script], stdout=PIPE, stderr=PIPE)
+		_, err = P.communicate()
+		if P.returncode != 0:
+			with open(logfile(), "a") as log:
+				log.write("{0} eos rm of {1} directories failed with exit code {2}:\n{3}\n".format(
+						  time.strftime("%Y-%m-%d %H:%M:%S"), len(paths), P.returncode,
+						  err.decode("utf8", "replace") if isinstance(err, bytes) else err))
+	except OSError:
+		pass
+	finally:
+		os.remove(script)
+
+
+class DeletionService(object):
+	"""
+	Removes files and directory trees in a bounded pool of threads, so that the cleanup of
+	the subjobs does not stall the commands. The path of a directory is free again as soon
+	as `remove` returns.
+	"""
+
+	def __init__(self, nthreads=DELETER_THREADS):
+		self.nthreads = nthreads
+		self.executor = None
+		self.lock = threading.Lock()
+		self.futures = set()
+		self.eos = []
+		self._count = 0
+
+	def trashname(self, path):
+		directory, name = os.path.split(os.path.normpath(path))
+		self._count += 1
+		return os.path.join(directory, ".{0}.deleted.{1}.{2}.{3}".format(name, hostname(), os.getpid(), self._count))
+
+	def remove(self, path):
+		"""
+		Queues the removal of path.
+		"""
+		if not os.path.isdir(path) or os.path.islink(path):
+			RemoveTree(path)
+			return
+
+		with self.lock:
+			trash = self.trashname(path)
+			try:
+				os.rename(path, trash)
+			except OSError:
+				trash = None
+
+		if trash is None:
+			# the path is removed before returning if it could not be renamed, it may be reused
+			self._run(path)
+		else:
+			self._queue(self._run, trash)
+		
+	def sweep(self, roots):
+		"""
+		Queues the removal of the directories renamed aside on this host by the sessions which
+		were killed before removing them, looked for in the roots and their subdirectories.
+		"""
+		self._queue(self._sweep, roots)
+		
+	def _sweep(self, roots):
+		host = hostname()
+		
+		directories = []
+		for root in roots:
+			directories.append(root)
+			try:
+				directories += [os.path.join(root, d) for d in os.listdir(root) if not TRASH.match(d)]
+			except OSError:
+				continue
+				
+		for directory in directories:
+			try:
+				names = os.listdir(directory)
+			except OSError:
+				continue
+			for name in names:
+				match = TRASH.match(name)
+				if match is None or match.group("host") != host:
+					continue
+				pid = int(match.group("pid"))
+				if pid != os.getpid() and not isalive(pid):
+					self._queue(self._run, os.path.join(directory, name))
+		
+	def _queue(self, fn, *args):
+		"""
+		Runs fn in the pool, or right away if there is none.
+		"""
+		if ThreadPoolExecutor is not None:
+			with self.lock:
+				if self.executor is None:
+					self.executor = ThreadPoolExecutor(max_workers=self.nthreads)
+				future = self.executor.submit(fn, *args)
+				self.futures.add(future)
+			future.add_done_callback(self._done)
+		else:
+			fn(*args)
+
+	def _done(self, future):
+		with self.lock:
+			self.futures.discard(future)
+
+	def _run(self, path):
+		with record("rmtree"):
+			RemoveTree(path)
+
+		if "eos" in path and os.path.isdir(path):
+			with self.lock:
+				self.eos.append(path)
+
+		with self.lock:
+			# the last removal running, or a full batch, sends the batch to eos
+			if len(self.eos) >= EOS_BATCH or len(self.futures) <= 1:
+				batch, self.eos = self.eos, []
+			else:
+				batch = []
+
+		if batch:
+			with record("eos rm"):
+				EosRemove(batch)
+
+	def isremoving(self):
+		return len(self.futures) > 0
+
+	def wait(self):
+		while True:
+			with self.lock:
+				futures = list(self.futures)
+			if not futures:
+				break
+			for future in futures:
+				future.result()
+
+		with self.lock:
+			batch, self.eos = self.eos, []
+		if batch:
+			EosRemove(batch)
+
+_deleter = None
+
+def getdeleter():
+	"""
+	Deletion service shared by all the jobs of the session.
+	"""
+	global _deleter
+	if _deleter is None:
+		_deleter = DeletionService()
+		roots = [os.getenv("SIMOUTPUT"), os.getenv("LOG_SIMOUTPUT")]
+		_deleter.sweep([root for root in roots if root and os.path.isdir(root)])
+	return _deleter
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+## Description: status of HTCondor jobs from their user event logs
+
+import os
+import re
+import time
+import json as js
+
+DEBUG = 0
+
+EVENT_HEADER = re.compile(r"^(\d{3}) \((\d+)\.(\d+)\.\d+\)")
+RETURN_VALUE = re.compile(r"\(return value (\d+)\)")
+EVENT_END = b"...\n"
+
+# event codes of the user log, see the HTCondor manual
+SUBMIT = 0
+EXECUTE = 1
+EXECUTABLE_ERROR = 2
+EVICTED = 4
+TERMINATED = 5
+SHADOW_EXCEPTION = 7
+ABORTED = 9
+HELD = 12
+RELEASED = 13
+
+EVENT_STATUS = {SUBMIT: "submitted",
+				EXECUTE: "running",
+				EXECUTABLE_ERROR: "failed",
+				EVICTED: "submitted",
+				SHADOW_EXCEPTION: "submitted",
+				ABORTED: "failed",
+				HELD: "failed",
+				RELEASED: "submitted"}
+
+def defaultstatefile():
+	simprod = os.getenv("SIMPRODPATH")
+	if simprod is None:
+		return None
+	return "{0}/htcondor_eventlogs.json".format(simprod)
+
+def parse_events(text):
+	"""
+	Parses the complete events of a user log, returns a list of (ClusterID, ProcID, status).
+	"""
+	events = []
+	for block in text.split("...\n"):
+		lines = block.strip("\n").split("\n")
+		header = EVENT_HEADER.match(lines[0])
+		if header is None:
+			continue
+
+		code, ClusterID, ProcID = (int(g) for g in header.groups())
+
+		if code == TERMINATED:
+			body = "\n".join(lines[1:])
+			returnvalue = RETURN_VALUE.search(body)
+			if "Normal termination" in body and returnvalue is not None and int(returnvalue.group(1)) == 0:
+				status = "completed"
+			else:
+				status = "failed"
+		elif code in EVENT_STATUS:
+			status = EVENT_STATUS[code]
+		else:
+			continue
+
+		events.append((ClusterID, ProcID, status))
+
+	return events
+
+
+class EventLogTracker(object):
+	"""
+	Follows the user logs, {logdir}/$(ClusterId).log, of the submitted clusters. Each log
+	is read incrementally from the byte offset reached at the previous read, offsets
+	and job statuses are saved in a state file to be resumed in the next session.
+	"""
+
+	def __init__(self, statefile=None, interval=5):
+
+		self.statefile = statefile
+		self.interval = interval #seconds, minimum time between two reads of a log
+		self.logs = {}
+		self._clusters = {}
+		self._lastread = {}
+		self._changed = False
+
+		if self.statefile is not None and os.path.isfile(self.statefile):
+			self.load()
+
+	def load(self):
+		try:
+			with open(self.statefile, "r") as f:
+				state = js.load(f)
+		except ValueError:
+			print("HTCondor event log state {0} is corrupted, logs are read again.".format(self.statefile))
+			state = {}
+
+		for logfile, log in state.items():
+			if not os.path.isfile(logfile):
+				self._changed = True
+				continue
+			jobs = {}
+			for ID, status in log["jobs"].items():
+				ClusterID, ProcID = ID.split(".")
+				jobs[(int(ClusterID), int(ProcID))] = status
+			self._add(logfile, log["offset"], jobs)
+
+	def save(self):
+		if self.statefile is None or not self._changed:
+			return
+
+		state = {}
+		for logfile, log in self.logs.items():
+			jobs = {"{0}.{1}".format(*ID): status for ID, status in log["jobs"].items()}
+			state[logfile] = {"offset": log["offset"], "jobs": jobs}
+
+		tmpfile = self.statefile + ".tmp"
+		with open(tmpfile, "w") as f:
+			js.dump(state, f)
+		os.rename(tmpfile, self.statefile)
+		self._changed = False
+
+	def _add(self, logfile, offset=0, jobs=None):
+		self.logs[logfile] = {"offset": offset, "jobs": jobs or {}}
+		cluster = os.path.basename(logfile).split(".")[0]
+		if cluster.isdigit():
+			self._clusters[int(cluster)] = logfile
+
+	def watch(self, logfile):
+		if logfile not in self.logs:
+			self._add(logfile)
+			self._changed = True
+
+	def forget(self, ClusterID):
+		logfile = self._clusters.pop(ClusterID, None)
+		if logfile is not None:
+			self.logs.pop(logfile, None)
+			self._lastread.pop(logfile, None)
+			self._changed = True
+
+	def read(self, logfile):
+		"""
+		Reads the events appended to the log since the last read, returns the number of
+		new events.
+		"""
+		log = self.logs[logfile]
+		self._lastread[logfile] = time.time()
+
+		if not os.path.isfile(logfile):
+			return 0
+
+		if os.path.getsize(logfile) < log["offset"]:
+			# log rewritten, e.g. cluster number reused
+			log["offset"] = 0
+			log["jobs"] = {}
+
+		with open(logfile, "rb") as f:
+			f.seek(log["offset"])
+			data = f.read()
+
+		# only complete events are consumed, a partially written one is read next time
+		end = data.rfind(EVENT_END)
+		if end < 0:
+			return 0
+		end += len(EVENT_END)
+
+		events = parse_events(data[:end].decode("utf-8", "replace"))
+		for ClusterID, ProcID, status in events:
+			log["jobs"][(ClusterID, ProcID)] = status
+		log["offset"] += end
+		self._changed = True
+
+		if DEBUG > 0:
+			print("In EventLogTracker.read: {0} events in {1}".format(len(events), logfile))
+
+		return len(events)
+
+	def status(self, ClusterID, ProcID):
+		"""
+		Status of the job from the event log of its cluster, None if the cluster is not
+		followed or if the job has no event yet.
+		"""
+		logfile = self._clusters.get(ClusterID)
+		if logfile is None:
+			return None
+
+		if time.time() - self._lastread.get(logfile, 0) > self.interval:
+			if self.read(logfile) > 0:
+				self.save()
+
+		return self.logs[logfile]["jobs"].get((ClusterID, ProcID))
@@ -16,11 +16,17 @@ from .dependencies import LazyModule
 from .utilities import *
 from .submit import SendCommand
 from .Status import Status
+from .HTCondorEventLog import EventLogTracker, defaultstatefile
+from .Profiling import record
 
 htcondor = LazyModule("htcondor")
 
 DEBUG = 0
 
+# maximum run time of the job flavours, in minutes
+JOBFLAVOURS = {"espresso": 20, "microcentury": 60, "longlunch": 120, "workday": 480,
+			   "tomorrow": 1440, "testmatch": 4320, "nextweek": 10080}
+
 def DefaultHTCondorOptions():
 	
 	options = {}		
@@ -38,57 +44,121 @@ def run(command):
 	
 	
 class Scheduler():
+	"""
+	Interface to the schedd. The status of all the jobs of the user is taken with one
+	query per refresh cycle (a snapshot), shared by all the jobs using this scheduler.
+	The event logs of the submitted clusters are followed first, the schedd is only
+	queried for the jobs without event.
+	"""
 	
 	def __init__(self):
-		self._schedd = htcondor.Schedd()
+		self._schedd = None
 		self.query = None
+		self.eventlogs = EventLogTracker(defaultstatefile())
 	
 	def getquery(self):
 		user = getpass.getuser()
 		try:
-			query = self._schedd.query('User=="{0}@cern.ch"'.format(user), ["ClusterID", "JobStatus", "ProcID"])
+			with record("condor_q"):
+				query = self.schedd.query('User=="{0}@cern.ch"'.format(user), ["ClusterID", "JobStatus", "ProcID"])
 			self.query = QueryResult(query)
 			return True
 		except (RuntimeError, IOError):
 			print(red("Failed to query job status. Thank you HTCondor ... Try later!"))
+			self.query = BadQuery()
 			return False
 			
-	def getcluster(self, ClusterID):
-		if self.query is None:
-			if not self.getquery():
-				return BadQuery()
+	def snapshot(self):
+		if self.query is None or not self.query.isvalid:
+			self.getquery()
+		return self.query
+			
+	def getjob(self, ClusterID, ProcID):
+		snapshot = self.snapshot()
+		if isinstance(snapshot, BadQuery):
+			return snapshot
 		else:
-			if not self.query.isvalid:
-				if not self.getquery():
-					return BadQuery()
-				
-		if self.query is None:
+			return snapshot.get(ClusterID, ProcID)
+			
+	def invalidate(self):
+		self.query = None
+			
+	@property
+	def schedd(self):
+		if self._schedd is None:
+			self._schedd = htcondor.Schedd()
+		return self._schedd
+			
+	def submit(self, description, itemdata):
+		"""
+		Submits one cluster with one job per item of itemdata, in one transaction. Returns
+		the ClusterId and the ProcId of the first job.
+		"""
+		submit = htcondor.Submit(description)
+		with record("condor_submit"):
+			try:
+				result = self.schedd.submit(submit, itemdata=iter(itemdata))
+			except TypeError:
+				# bindings older than 9.0
+				with self.schedd.transaction() as txn:
+					result = submit.queue_with_itemdata(txn, 1, iter(itemdata))
+		return result.cluster(), result.first_proc()
+		
+	def procids(self, ClusterID):
+		"""
+		ProcId of the jobs of a cluster by subjob number, read from the SimprodSubjob attribute
+		of the jobs. Returns None if the schedd could not be queried.
+		"""
+		try:
+			with record("condor_q"):
+				query = self.schedd.query("ClusterId=={0}".format(ClusterID), ["ClusterId", "ProcId", "SimprodSubjob"])
+		except (RuntimeError, IOError):
 			return None
-		else:
-			ret = []
-			for q in self.query:
-				if q["ClusterID"] == ClusterID:
-					ret.append(q)
-			return QueryResult(ret)
+		return dict((int(q["SimprodSubjob"]), int(q["ProcId"])) for q in query if "SimprodSubjob" in q)
 			
 	def act(self, *args, **kwargs):
-		self._schedd.act(*args, **kwargs)
+		self.schedd.act(*args, **kwargs)
 			
 	def renew(self):
 		self._schedd = htcondor.Schedd()
 		
+_scheduler = None
+
+def HasBindings():
+	try:
+		htcondor.Submit
+		return True
+	except ImportError:
+		return False
+		
+def getscheduler():
+	"""
+	Scheduler shared by all the jobs of the session.
+	"""
+	global _scheduler
+	if _scheduler is None:
+		_scheduler = Scheduler()
+	return _scheduler
+		
 class BadQuery(object):
 	
 	def __init__(self, *args, **kwargs):
-		pass
+		self.creation_time = datetime.datetime.now()
+		
+	@property
+	def isvalid(self):
+		# the schedd is not queried again before one minute after a failure
+		elapsedTime = datetime.datetime.now() - self.creation_time
+		return elapsedTime.total_seconds() < 60
 			
 class QueryResult(object):
 	
 	def __init__(self, query):
 		
-		self.query = query
 		self.creation_time = datetime.datetime.now()
-		self._cache = {}
+		self.jobs = {}
+		for q in query:
+			self.jobs[(int(q["ClusterID"]), int(q["ProcID"]))] = q
 
 	@property
 	def isvalid(self):
@@ -101,22 +171,14 @@ class QueryResult(object):
 			return True
 		
 	def __iter__(self):
-		for q in self.query:
+		for q in self.jobs.values():
 			yield q
 			
-	def getProcID(self, ID):
-		ret = None
-		
-		if ID in self._cache.keys():
-			ret = self._cache[ID]
-		else:
-			querys = list(self.query)
-			for q in querys:
-				if ID == q["ProcID"]:
-					ret = q
-					self._cache[ID] = q
-					self.query.remove(q)
-		return ret
+	def __len__(self):
+		return len(self.jobs)
+			
+	def get(self, ClusterID, ProcID):
+		return self.jobs.get((ClusterID, ProcID), None)
 
 class DeliveryClerk(object):
 	
@@ -125,7 +187,6 @@ class DeliveryClerk(object):
 		default_options = DefaultHTCondorOptions()
 		self.default_options = default_options
 		self._schedd = kwargs.get("scheduler")
-		self._query = None
 		
 		self.defaults = []
 		options = {}
@@ -140,6 +201,11 @@ class DeliveryClerk(object):
 		self.addvar("jobflavour", allowed_values = ["espresso", "microcentury", "longlunch", "workday",
 													"tomorrow", "testmatch", "nextweek"])
 		
+	@property
+	def maxruntime(self):
+		# minutes
+		return JOBFLAVOURS.get(self.options["jobflavour"])
+		
 		
 	def outdict(self):
 		return {"options": self.options}
@@ -150,6 +216,12 @@ class DeliveryClerk(object):
 		deliveryclerk = cls(**dict["options"])	
 		deliveryclerk._schedd = kwargs.get("scheduler", None)	
 		return deliveryclerk
+		
+	@property
+	def scheduler(self):
+		if self._schedd is None:
+			self._schedd = getscheduler()
+		return self._schedd
 			
 						
 	def send_job(self, job, *args, **kwargs):
@@ -180,59 +252,27 @@ class DeliveryClerk(object):
 		sub.call(['chmod', '775', doprod])
 			
 		create_runfile(runfile, doprod)
-		 
-		condor = open(subfile, "w")
-		condor.write("executable = {runfile}\n".format(runfile=runfile))
-		condor.write("output = $(subjob_log_dir)/out\n")
-		condor.write("error = $(subjob_log_dir)/err\n")
-		condor.write("log = {logdir}/$(ClusterId).log\n".format(logdir=logdir))
-		condor.write('+JobFlavour = "{jobflavour}"\n\n'.format(jobflavour=self.options["jobflavour"]))
 		
 		submitted_jobs = []
 		
-		ext = "mdst" if job.mudst else "dst"
-		nevts = job.neventsjob
-		
 		for n in job.range_subjobs:	
 			sj = job[n]
 			if not sj._status.submitted:
-				sjlogdir = "{logdir}/{sjname}".format(logdir=logdir, sjname=sj.jobname)
-				if os.path.isdir(sjlogdir):
-					shutil.rmtree(sjlogdir, ignore_errors = True)
-				os.makedirs(sjlogdir)
-				if os.path.isdir(sj.jobdir):
-					shutil.rmtree(sj.jobdir, ignore_errors = True)
-				os.makedirs(sj.jobdir)
-				
-				if sj.infiles:
-					condor.write("transfer_input_files = {0}\n".format(",".join(sj.infiles)))
-					
-				condor.write("subjob_log_dir={sjlogdir}\n".format(sjlogdir=sjlogdir))
-				args = " ".join(str(a) for a in sj.command()["args"])
-				condor.write("arguments = {args}\n".format(args=args))
-				totransfer = 'transfer_output_remaps = "{nevts}_events.{ext}={prodfile} '.format(nevts=nevts, ext=ext, prodfile=sj.prodfile)
-				totransfer += ' ; GeneratorLog.xml={dir}/GeneratorLog.xml"\n'.format(dir=sj.jobdir)
-				condor.write(totransfer)
-				condor.write("queue\n\n")	
 				submitted_jobs.append(sj)
-		condor.close()
-		
-		command = "condor_submit {subfile}".format(subfile=subfile)
+				
+		if len(submitted_jobs) == 0:
+			return
 				
 		print(blue("Submitting jobs: ...."))
-
-		out = SendCommand(command)
-		try:
-			ClusterID = int(float(out.split("\n")[1].split(" ")[-1]))
-			print(blue(out.split("\n")[1]))
-		except IndexError:
+				
+		jobids = self._submit(job, submitted_jobs, logdir, runfile, subfile)
+		
+		if jobids is None:
 			print(red("job {0} submission failed, try later!".format(job.jobnumber)))
-			ClusterID = None
-			
-		if ClusterID is not None:
-			for n, sj in enumerate(submitted_jobs):
-				sj.jobid = "{0}.{1}".format(ClusterID, n)
-				sj._status = Status("submitted", sj.output)
+		else:
+			for sj, jobid in zip(submitted_jobs, jobids):
+				sj.jobid = jobid
+				sj._status = Status("submitted", sj.output, inventory=sj.inventory)
 			
 												
 	def send_subjob(self, subjob):
@@ -265,7 +305,75 @@ class DeliveryClerk(object):
 				sub.call(['chmod', '775', doprod])
 				
 			create_runfile(runfile, doprod)
+
+			print(blue("Submitting jobs ...."))
+			
+			jobids = self._submit(job, [subjob], logdir, runfile, subfile)
+			
+			if jobids is None:
+				print(red("job {0} submission failed, try later!".format(job.jobnumber)))
+			else:
+				subjob.jobid = jobids[0]
+				subjob._status = Status("submitted", subjob.output, inventory=subjob.inventory)
+				
+			return subjob.jobid
+				
+				
+	def _itemdata(self, subjob, logdir):
+		"""
+		Submission variables of a subjob, its directories are created anew.
+		"""
+		job = subjob.parent
+		ext = "mdst" if job.mudst else "dst"
+		
+		sjlogdir = "{logdir}/{sjname}".format(logdir=logdir, sjname=subjob.jobname)
+		if os.path.isdir(sjlogdir):
+			silentrm(sjlogdir)
+		os.makedirs(sjlogdir)
+		if os.path.isdir(subjob.jobdir):
+			silentrm(subjob.jobdir)
+		os.makedirs(subjob.jobdir)
+		
+		remaps = "{nevts}_events.{ext}={prodfile} ".format(nevts=job.neventsjob, ext=ext, prodfile=subjob.prodfile)
+		remaps += " ; GeneratorLog.xml={dir}/GeneratorLog.xml".format(dir=subjob.jobdir)
+		
+		item = {}
+		item["subjob"] = str(subjob.subjobnumber)
+		item["sjlogdir"] = sjlogdir
+		item["arguments"] = " ".join(str(a) for a in subjob.command()["args"])
+		item["infiles"] = ",".join(subjob.infiles)
+		item["remaps"] = remaps
+		return item
+		
+		
+	def _submit(self, job, subjobs, logdir, runfile, subfile):
+		"""
+		Submits the subjobs as one cluster, returns their job ids or None if the submission
+		failed. The htcondor bindings are used if available, condor_submit otherwise.
+		"""
+		items = [self._itemdata(sj, logdir) for sj in subjobs]
+		
+		if HasBindings():
+			description = {}
+			description["executable"] = runfile
+			description["arguments"] = "$(arguments)"
+			description["output"] = "$(sjlogdir)/out"
+			description["error"] = "$(sjlogdir)/err"
+			description["log"] = "{logdir}/$(ClusterId).log".format(logdir=logdir)
+			description["transfer_input_files"] = "$(infiles)"
+			description["transfer_output_remaps"] = '"$(remaps)"'
+			description["+JobFlavour"] = '"{jobflavour}"'.format(jobflavour=self.options["jobflavour"])
+			description["+SimprodSubjob"] = "$(subjob)"
+			
+			try:
+				ClusterID, FirstProcID = self.scheduler.submit(description, items)
+			except (RuntimeError, IOError, ValueError) as err:
+				print(red(str(err)))
+				return None
+			print(blue("{0} job(s) submitted to cluster {1}.".format(len(items), ClusterID)))
+			procids = self.scheduler.procids(ClusterID)
 			
+		else:
 			condor = open(subfile, "w")
 			condor.write("executable = {runfile}\n".format(runfile=runfile))
 			condor.write("output = $(subjob_log_dir)/out\n")
@@ -273,47 +381,47 @@ class DeliveryClerk(object):
 			condor.write("log = {logdir}/$(ClusterId).log\n".format(logdir=logdir))
 			condor.write('+JobFlavour = "{jobflavour}"\n\n'.format(jobflavour=self.options["jobflavour"]))
 			
-			submitted_jobs = []
-			
-			ext = "mdst" if job.mudst else "dst"
-			nevts = job.neventsjob
-			
-			sjlogdir = "{logdir}/{sjname}".format(logdir=logdir, sjname=subjob.jobname)
-			if os.path.isdir(sjlogdir):
-				shutil.rmtree(sjlogdir, ignore_errors = True)
-			os.makedirs(sjlogdir)
-			if os.path.isdir(subjob.jobdir):
-				shutil.rmtree(subjob.jobdir, ignore_errors = True)
-			os.makedirs(subjob.jobdir)
-			
-			if subjob.infiles:
-				condor.write("transfer_input_files = {0}\n".format(",".join(subjob.infiles)))
-				
-			condor.write("subjob_log_dir={sjlogdir}\n".format(sjlogdir=sjlogdir))
-			args = " ".join(str(a) for a in subjob.command()["args"])
-			condor.write("arguments = {args}\n".format(args=args))
-			totransfer = 'transfer_output_remaps = "{nevts}_events.{ext}={prodfile} '.format(nevts=nevts, ext=ext, prodfile=subjob.prodfile)
-			totransfer += ' ; GeneratorLog.xml={dir}/GeneratorLog.xml"\n'.format(dir=subjob.jobdir)
-			condor.write(totransfer)
-			condor.write("queue\n\n")	
+			for item in items:
+				condor.write("+SimprodSubjob = {subjob}\n".format(subjob=item["subjob"]))
+				if item["infiles"]:
+					condor.write("transfer_input_files = {0}\n".format(item["infiles"]))
+				condor.write("subjob_log_dir={sjlogdir}\n".format(sjlogdir=item["sjlogdir"]))
+				condor.write("arguments = {args}\n".format(args=item["arguments"]))
+				condor.write('transfer_output_remaps = "{remaps}"\n'.format(remaps=item["remaps"]))
+				condor.write("queue\n\n")	
 			condor.close()
 			
 			command = "condor_submit {subfile}".format(subfile=subfile)
-
-			print(blue("Submitting jobs ...."))
 			
 			out = SendCommand(command)
 			try:
 				ClusterID = int(float(out.split("\n")[1].split(" ")[-1]))
 				print(blue(out.split("\n")[1]))
-			except IndexError:
-				print(red("job {0} submission failed, try later!".format(job.jobnumber)))
-				ClusterID = None
+			except (IndexError, ValueError):
+				return None
+			FirstProcID = 0
+			
+			out = SendCommand("condor_q {cid} -af SimprodSubjob ProcId".format(cid=ClusterID))
+			try:
+				procids = dict(tuple(int(v) for v in line.split()) for line in out.split("\n") if line.strip())
+			except ValueError:
+				procids = None
 			
-			if ClusterID is not None:	
-				subjob.jobid = "{0}.{1}".format(ClusterID, n)
-				subjob._status = Status("submitted", subjob.output)
+		# the ProcIds are taken from the subjob numbers stored in the jobs, the order of the items
+		# is assumed only if the schedd could not be queried
+		if procids is None:
+			print(red("WARNING\tthe jobs of cluster {0} could not be queried, their order is assumed".format(ClusterID)))
+			procids = {}
+		ProcIDs = [procids.get(int(item["subjob"]), FirstProcID + i) for i, item in enumerate(items)]
 			
+		self.scheduler.eventlogs.watch("{logdir}/{cid}.log".format(logdir=logdir, cid=ClusterID))
+		self.scheduler.invalidate()
+			
+		return ["{0}.{1}".format(ClusterID, ProcID) for ProcID in ProcIDs]
+			
+			
+	def track(self, IDs):
+		pass
 			
 	def getstatus(self, ID):
 		
@@ -328,41 +436,32 @@ class DeliveryClerk(object):
 			print("ClusterID: ", ClusterID)
 			print("ProcID: ", ProcID)
 			
-		if DEBUG > 0:	
-			print(self._query)
+		status = self.scheduler.eventlogs.status(ClusterID, ProcID)
+		if status is not None:
+			return status
+		
+		queryjob = self.scheduler.getjob(ClusterID, ProcID)
 		
-		if self._query is None:
-			self._query = self._schedd.getcluster(ClusterID)
 		if DEBUG > 0:	
-			print(self._query)
+			print(queryjob)
 			
-		if self._query is None:
-			return "new"
-		elif isinstance(self._query, BadQuery):
+		if isinstance(queryjob, BadQuery):
 			return "error"
-		else:	
-			if not self._query.isvalid:
-				self._query = self._schedd.getcluster(ClusterID)
-				
-			if isinstance(self._query, BadQuery):
-				return "error"
-					
-			queryjob = self._query.getProcID(ProcID)
-			if queryjob is None:
-				return "notfound"
+		elif queryjob is None:
+			return "notfound"
+		else:
+			status = queryjob["JobStatus"]
+			
+			if status in [0, 3, 5, 6]:
+				return "failed"
+			elif status == 1:
+				return "submitted"
+			elif status == 2:
+				return "running"
+			elif status == 4:
+				return "completed"
 			else:
-				status = queryjob["JobStatus"]
-				
-				if status in [0, 3, 5, 6]:
-					return "failed"
-				elif status == 1:
-					return "submitted"
-				elif status == 2:
-					return "running"
-				elif status == 4:
-					return "completed"
-				else:
-					return "notfound"
+				return "notfound"
 				
 	
 	def get_update_subjobs(self, job):
@@ -370,7 +469,10 @@ class DeliveryClerk(object):
 		
 		
 	def clear(self, job):
-		pass
+		for sj in job:
+			if sj.jobid is not None:
+				self.scheduler.eventlogs.forget(int(str(sj.jobid).split(".")[0]))
+		self.scheduler.eventlogs.save()
 	
 	
 	def kill(self, **kwargs):
@@ -390,7 +492,7 @@ class DeliveryClerk(object):
 					
 		for cid in cluster_ids:
 			try:
-				self._schedd.act(htcondor.JobAction.Remove, 'ClusterId=={0}'.format(cid))
+				self.scheduler.act(htcondor.JobAction.Remove, 'ClusterId=={0}'.format(cid))
 			except RuntimeError:
 				kill = Popen(['condor_rm', str(cid)], stdout=PIPE, stderr=PIPE)
 				out, err = kill.communicate()
@@ -404,7 +506,7 @@ class DeliveryClerk(object):
 				ID = str(ID)
 			ClusterID = int(ID.split(".")[0])
 			ProcID = int(ID.split(".")[1])
-			self._schedd.act(htcondor.JobAction.Remove, 'ClusterId=={0} && ProcID=={1}'.format(ClusterID, ProcID))
+			self.scheduler.act(htcondor.JobAction.Remove, 'ClusterId=={0} && ProcID=={1}'.format(ClusterID, ProcID))
 		except RuntimeError:
 			kill = Popen(['condor_rm', str(ID)], stdout=PIPE, stderr=PIPE)
 			out, err = kill.communicate()	
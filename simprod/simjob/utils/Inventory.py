@@ -0,0 +1,103 @@
+#!/usr/bin/python
+
+## Description: inventory of the files of a job. The production and destination directories
+## are listed with one scandir each and the listings are reused during a refresh cycle,
+## instead of probing every output file with stat.
+
+import os
+import time
+import errno
+
+from .Profiling import record, isfile, getsize
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		# python 2 without the scandir backport, the files are probed one by one
+		scandir = None
+
+DEBUG = 0
+
+class FileInventory(object):
+	"""
+	Files of the directories of a job, a directory is listed the first time a file in it is
+	looked up and its listing is kept until `clear` or for `ttl` seconds. A subdirectory of
+	one of the roots (e.g. the directory of a subjob in the production directory) is only
+	listed if it appears in the listing of the root.
+	"""
+
+	def __init__(self, roots=(), ttl=60):
+		self.roots = set(roots)
+		self.ttl = ttl #seconds
+		self.listings = {}
+
+	def clear(self, roots=None):
+		"""
+		Starts a new refresh cycle, all the directories are listed again.
+		"""
+		if roots is not None:
+			self.roots = set(roots)
+		self.listings = {}
+
+	def invalidate(self, *directories):
+		# e.g. after files have been moved or removed
+		for directory in directories:
+			self.listings.pop(directory, None)
+
+	def listdir(self, directory):
+		"""
+		Entries of the directory, {name: DirEntry}, empty if the directory does not exist.
+		"""
+		listing = self.listings.get(directory)
+		if listing is not None and time.time() - listing[0] < self.ttl:
+			return listing[1]
+
+		entries = {}
+
+		parent, name = os.path.split(directory)
+		if parent in self.roots:
+			entry = self.listdir(parent).get(name)
+			if entry is None or not entry.is_dir():
+				self.listings[directory] = (time.time(), entries)
+				return entries
+
+		with record("scandir"):
+			try:
+				for entry in scandir(directory):
+					entries[entry.name] = entry
+			except OSError:
+				pass
+
+		if DEBUG > 0:
+			print("In FileInventory.listdir: {0} entries in {1}".format(len(entries), directory))
+
+		self.listings[directory] = (time.time(), entries)
+		return entries
+
+	def _entry(self, path):
+		directory, name = os.path.split(path)
+		return self.listdir(directory).get(name)
+
+	def isfile(self, path):
+		if scandir is None:
+			return isfile(path)
+		entry = self._entry(path)
+		return entry is not None and entry.is_file()
+
+	def isdir(self, path):
+		if scandir is None:
+			return os.path.isdir(path)
+		entry = self._entry(path)
+		return entry is not None and entry.is_dir()
+
+	def getsize(self, path):
+		if scandir is None:
+			return getsize(path)
+		entry = self._entry(path)
+		if entry is None:
+			raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+		# the stat of the entry is cached by the DirEntry
+		return entry.stat().st_size
@@ -6,10 +6,17 @@
 from subprocess import Popen, PIPE
 from datetime import datetime
 import os
+import re
+import getpass
+import time
 from .utilities import *
 import sys
 from .submit import main as submit
 from .Status import Status
+from .Profiling import record
+
+# maximum (normalised) run time of the queues, in minutes
+QUEUES = {"8nm": 8, "1nh": 60, "8nh": 480, "1nd": 1440, "2nd": 2880, "1nw": 10080, "2nw": 20160}
 
 def Kill(ID):
 	
@@ -56,6 +63,102 @@ def GetStatus(ID):
 	
 	#### put a try and catch
 	
+LSF_STATES = {"PEND": "submitted", "PSUSP": "submitted", "WAIT": "submitted", "RUN": "running",
+			  "DONE": "completed", "EXIT": "cancelled", "USUSP": "cancelled", "SSUSP": "cancelled",
+			  "UNKWN": "failed", "ZOMBI": "failed"}
+			  
+BJOBS_CHUNK = 500 #job ids per bjobs call
+
+NOTFOUND = re.compile(r"Job <(\S+)> is not found")
+			  
+def LSFState(state):
+	return LSF_STATES.get(state.strip().upper(), "notfound")
+	
+def JobStates(IDs=None):
+	"""
+	States of the jobs of the user, {jobid: state}, or of the jobs in IDs. The jobs unknown
+	to LSF are returned as "notfound".
+	"""
+	command = ["bjobs", "-a", "-o", "jobid stat", "-noheader"]
+	if IDs is None:
+		command += ["-u", getpass.getuser()]
+	else:
+		command += list(IDs)
+	
+	with record("bjobs"):
+		if sys.version_info[0] > 2:	
+			process  = Popen(command, stdout=PIPE, stderr=PIPE, encoding='utf8')
+		else:
+			process  = Popen(command, stdout=PIPE, stderr=PIPE)
+		out, err = process.communicate()
+	
+	states = {}
+	for line in out.split("\n"):
+		line = line.split()
+		if len(line) == 2:
+			states[line[0]] = LSFState(line[1])
+	for ID in NOTFOUND.findall(err):
+		states[ID] = "notfound"
+		
+	if len(states) == 0 and process.returncode != 0 and "No job found" not in err and "No unfinished job found" not in err:
+		print(red("'bjobs' failed: {0}".format(err.strip())))
+		return None
+		
+	return states
+	
+class StatusCache(object):
+	"""
+	Status of the tracked LSF jobs, refreshed with one bjobs call per cycle for all the jobs
+	of the user and one bjobs call for the tracked jobs missing from it.
+	"""
+	
+	def __init__(self, ttl=60):
+		self.ttl = ttl #seconds, lifetime of a bjobs snapshot
+		self.tracked = set()
+		self.states = {}
+		self.creation_time = None
+		
+	@property
+	def isvalid(self):
+		return self.creation_time is not None and time.time() - self.creation_time < self.ttl
+		
+	def track(self, IDs):
+		for ID in IDs:
+			if ID is not None:
+				self.tracked.add(str(ID))
+				
+	def refresh(self):
+		states = JobStates()
+		if states is None:
+			return False
+		self.states = states
+		self.creation_time = time.time()
+		self.update_missing(self.tracked)
+		return True
+		
+	def update_missing(self, IDs):
+		missing = [ID for ID in IDs if ID not in self.states]
+		for i in range(0, len(missing), BJOBS_CHUNK):
+			states = JobStates(missing[i:i+BJOBS_CHUNK])
+			if states is not None:
+				self.states.update(states)
+			
+	def get(self, ID):
+		ID = str(ID)
+		
+		if ID not in self.tracked:
+			self.tracked.add(ID)
+			if self.isvalid:
+				self.update_missing([ID])
+				
+		if not self.isvalid:
+			if not self.refresh():
+				return "error"
+				
+		return self.states.get(ID, "error")
+		
+_statuscache = StatusCache()
+	
 class DeliveryClerk(object):
 	
 	def __init__(self, **kwargs):
@@ -79,6 +182,11 @@ class DeliveryClerk(object):
 		self.addvar("cpu_memory")
 		self.addvar("queue", allowed_values = ["8nm","1nh","8nh","1nd","2nd","1nw","2nw"])
 		
+	@property
+	def maxruntime(self):
+		# minutes
+		return QUEUES.get(self.options["queue"])
+		
 	
 	def outdict(self):
 		return {"options": self.options}
@@ -111,8 +219,11 @@ class DeliveryClerk(object):
 	def get_update_subjobs(self, job):
 		return None
 		
+	def track(self, IDs):
+		_statuscache.track(IDs)
+		
 	def getstatus(self, ID):
-		return GetStatus(ID)
+		return _statuscache.get(ID)
 		
 	def clear(self, job):
 		pass
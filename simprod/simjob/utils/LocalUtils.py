@@ -0,0 +1,249 @@
+#!/usr/bin/python
+
+## Description: local backend, the subjobs are run on the current machine by a pool of
+## processes.
+
+import os
+import time
+import shutil
+import signal
+import atexit
+import multiprocessing
+from subprocess import Popen
+
+from .utilities import *
+
+try:
+	from concurrent.futures import ProcessPoolExecutor
+	hasfutures = True
+except ImportError:
+	# python 2 without the futures backport
+	hasfutures = False
+
+DEBUG = 0
+
+def DefaultLocalOptions():
+
+	options = {}
+	options["ncpus"] = multiprocessing.cpu_count()
+
+	return options
+
+def RunSubjob(command, jobdir):
+	"""
+	Runs the payload of a subjob in its directory and returns its exit code. The pid of the
+	payload is written in jobdir/pid while it runs, to be able to kill it.
+	"""
+	out = open(os.path.join(jobdir, "out"), "w")
+	err = open(os.path.join(jobdir, "err"), "w")
+	process = Popen(command, cwd=jobdir, stdout=out, stderr=err, preexec_fn=os.setsid)
+	pidfile = os.path.join(jobdir, "pid")
+	with open(pidfile, "w") as f:
+		f.write(str(process.pid))
+	try:
+		return process.wait()
+	finally:
+		out.close()
+		err.close()
+		if os.path.isfile(pidfile):
+			os.remove(pidfile)
+
+class LocalPool(object):
+	"""
+	Pool of processes running the subjobs. The status of a subjob is read from its future,
+	a subjob unknown to the pool (e.g. sent in a previous session) is "notfound", Status then
+	makes it completed or failed from its output.
+	"""
+
+	def __init__(self):
+		self.executor = None
+		self.ncpus = None
+		self.futures = {}
+		self.jobdirs = {}
+		self._count = 0
+
+	def submit(self, command, jobdir, ncpus):
+		if not hasfutures:
+			raise ImportError("The local backend needs concurrent.futures, install the 'futures' package.")
+
+		if self.executor is None or ncpus != self.ncpus:
+			if self.executor is not None:
+				# running subjobs keep going, only new ones use the new pool
+				self.executor.shutdown(wait=False)
+			self.executor = ProcessPoolExecutor(max_workers=ncpus)
+			self.ncpus = ncpus
+
+		self._count += 1
+		ID = "{0}.{1}".format(os.getpid(), self._count)
+		self.futures[ID] = self.executor.submit(RunSubjob, command, jobdir)
+		self.jobdirs[ID] = jobdir
+		return ID
+
+	def pid(self, ID):
+		pidfile = os.path.join(self.jobdirs[ID], "pid")
+		try:
+			with open(pidfile, "r") as f:
+				return int(f.read())
+		except (IOError, ValueError):
+			return None
+
+	def status(self, ID):
+		future = self.futures.get(ID)
+		if future is None:
+			return "notfound"
+		elif future.cancelled():
+			return "cancelled"
+		elif future.done():
+			if future.exception() is not None or future.result() != 0:
+				return "failed"
+			else:
+				return "completed"
+		elif self.pid(ID) is not None:
+			return "running"
+		else:
+			return "submitted"
+
+	def kill(self, ID):
+		future = self.futures.get(ID)
+		if future is None or future.cancel():
+			return
+		pid = self.pid(ID)
+		if pid is not None:
+			try:
+				os.killpg(pid, signal.SIGTERM)
+			except OSError:
+				pass
+
+	def forget(self, ID):
+		self.futures.pop(ID, None)
+		self.jobdirs.pop(ID, None)
+
+	def shutdown(self):
+		"""
+		Kills the subjobs run by the session and stops the workers.
+		"""
+		# the subjobs already given to a worker can still start after the pending ones are
+		# cancelled, they are killed until all the futures are done
+		for future in self.futures.values():
+			future.cancel()
+		while not all(future.done() for future in self.futures.values()):
+			for ID, future in list(self.futures.items()):
+				if not future.done():
+					self.kill(ID)
+			time.sleep(0.1)
+		if self.executor is not None:
+			self.executor.shutdown(wait=True)
+			self.executor = None
+
+_pool = LocalPool()
+
+def shutdown():
+	"""
+	Kills the subjobs run by the session, to be called before exiting: the exit handler of
+	concurrent.futures, run before the atexit ones, waits for the running subjobs.
+	"""
+	_pool.shutdown()
+
+atexit.register(shutdown)
+
+class DeliveryClerk(object):
+
+	def __init__(self, **kwargs):
+
+		default_options = DefaultLocalOptions()
+		self.default_options = default_options
+
+		self.defaults = []
+		options = {}
+
+		options["ncpus"] = kwargs.get("ncpus", default_options['ncpus'])
+		self.defaults += ["ncpus"]
+
+		self.options = options
+
+		self.addvar("ncpus")
+		
+	@property
+	def maxruntime(self):
+		# the subjobs run until they end
+		return None
+
+
+	def outdict(self):
+		return {"options": self.options}
+
+
+	@classmethod
+	def from_dict(cls, dict, **kwargs):
+		deliveryclerk = cls(**dict["options"])
+
+		return deliveryclerk
+
+
+	def send_job(self, job, *args, **kwargs):
+		for n in job.range_subjobs:
+			job[n].send()
+
+
+	def send_subjob(self, subjob):
+		if not subjob._status.submitted or subjob._status.failed:
+			if subjob._status.failed:
+				subjob.reset()
+
+			if os.path.isdir(subjob.jobdir):
+				silentrm(subjob.jobdir)
+			os.makedirs(subjob.jobdir)
+
+			for f in subjob.infiles:
+				shutil.copyfile(f, "{0}/{1}".format(subjob.jobdir, os.path.basename(f)))
+
+			command = ["bash", subjob.command()["doprod"]]
+			command += [str(a) for a in subjob.command()["args"]]
+
+			return _pool.submit(command, subjob.jobdir, self.options["ncpus"])
+
+
+	def get_update_subjobs(self, job):
+		return None
+
+	def track(self, IDs):
+		pass
+
+	def getstatus(self, ID):
+		return _pool.status(str(ID))
+
+	def clear(self, job):
+		# the completed and failed subjobs are not loaded, their jobids are read from the table
+		for doc in job.jobtable.all():
+			if doc.get("jobid") is not None:
+				_pool.forget(str(doc["jobid"]))
+
+	def kill(self, **kwargs):
+		return True
+
+	def killsubjob(self, ID):
+		_pool.kill(str(ID))
+
+	def addvar(self, var, allowed_values=[]):
+
+		def make_get_set(var):
+			def getter(self):
+				return self.options[var]
+			def setter(self, value):
+				if type(value) != type(self.default_options[var]):
+					msg = "A {} is required!".format(type(self.default_options[var]))
+					raise TypeError(msg)
+
+				if len(allowed_values) > 1 and value not in allowed_values:
+					raise ValueError("Allowed values for {0} are {1}".format(var, allowed_values))
+
+				self.options[var] = value
+				if var in self.defaults:
+					self.defaults.remove(var)
+
+			return getter, setter
+
+		get_set = make_get_set(var)
+
+		setattr(DeliveryClerk, var, property(*get_set))
+		self.__dict__[var] = getattr(DeliveryClerk, var)
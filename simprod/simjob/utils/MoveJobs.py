@@ -1,21 +1,296 @@
 #!/usr/bin/python
 
-import os, shutil
+## Description: moves of the outputs of the completed subjobs to their final destination,
+## done in the background by a pool of threads. On EOS the moves go through one XRootD
+## session if the XRootD python bindings are available, through xrdfs otherwise. The
+## adler32 checksum of each moved file is returned to be stored with the subjob.
 
-def Move( initial_file, destination_file ):
-	
+import os
+import zlib
+import threading
+import subprocess
+
+from .Profiling import record
+
+try:
+	from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+	# python 2 without the futures backport, the moves are done synchronously
+	ThreadPoolExecutor = None
+
+EOS_URL = "root://eoslhcb.cern.ch/"
+MOVER_THREADS = 4
+
+CHUNK_SIZE = 8 * 1024 * 1024 #bytes read and written at once by the copies
+CLEANUP = "cleanup" #key of the result of the cleanup after the moves
+
+def Checksum( value ):
+	return "{0:08x}".format(value & 0xffffffff)
+
+def Adler32( f, value=1, nbytes=None, chunksize=CHUNK_SIZE ):
+	"""
+	Adler32 of the content of the open file f, from its current position to its end or
+	for nbytes, starting from value.
+	"""
+	while nbytes is None or nbytes > 0:
+		chunk = f.read(chunksize if nbytes is None else min(chunksize, nbytes))
+		if not chunk:
+			break
+		value = zlib.adler32(chunk, value)
+		if nbytes is not None:
+			nbytes -= len(chunk)
+	return value
+
+def makedirs( directory ):
+	if not os.path.isdir(directory):
+		try:
+			os.makedirs(directory)
+		except OSError:
+			# created in the meantime by another mover thread
+			if not os.path.isdir(directory):
+				raise
+
+def Move( initial_file, destination_file, chunksize=CHUNK_SIZE ):
+	"""
+	Moves a file. On the same filesystem the file is only renamed, its content is not read,
+	and None is returned. Otherwise it is copied in chunks to destination_file.part, the copy is read
+	back and compared to the checksum of the source, and only then renamed to its
+	destination and the source removed, and the adler32 checksum of the file is returned.
+	A partial copy left by an interrupted move is resumed if it matches the beginning of
+	the source.
+	"""
 	destination_dir = os.path.dirname(destination_file)
-	
-	if not os.path.isdir(destination_dir):
-		os.makedirs(destination_dir)
-		
-	shutil.move( initial_file, destination_file )
-	
+	makedirs(destination_dir)
+
+	if os.stat(initial_file).st_dev == os.stat(destination_dir).st_dev:
+		os.rename(initial_file, destination_file)
+		return None
+
+	partfile = destination_file + ".part"
+	resumed = 0
+
+	with open(initial_file, "rb") as src:
+
+		if os.path.isfile(partfile) and 0 < os.path.getsize(partfile) <= os.path.getsize(initial_file):
+			size = os.path.getsize(partfile)
+			checksum = Adler32(src, nbytes=size, chunksize=chunksize)
+			with open(partfile, "rb") as part:
+				if Adler32(part, chunksize=chunksize) == checksum:
+					resumed = size
+				else:
+					src.seek(0)
+
+		if not resumed:
+			checksum = 1
+
+		with open(partfile, "ab" if resumed else "wb") as dst:
+			while True:
+				chunk = src.read(chunksize)
+				if not chunk:
+					break
+				checksum = zlib.adler32(chunk, checksum)
+				dst.write(chunk)
+			dst.flush()
+			os.fsync(dst.fileno())
+
+	with open(partfile, "rb") as part:
+		copied = Adler32(part, chunksize=chunksize)
+
+	if copied != checksum:
+		os.remove(partfile)
+		raise IOError("checksum of the copy of {0} does not match: {1} != {2}".format(initial_file, Checksum(copied),
+																					 Checksum(checksum)))
+
+	os.rename(partfile, destination_file)
+	os.remove(initial_file)
+
+	return Checksum(checksum)
+
+def ParseChecksum( response ):
+	# "adler32 0a1b2c3d" as answered by a checksum query
+	response = response.strip().strip("\x00").split()
+	if len(response) == 2 and response[0] == "adler32":
+		return response[1]
+	return None
+
+def XrdFs( *args ):
+
+	process = subprocess.Popen(["xrdfs", EOS_URL] + list(args), stdout=subprocess.PIPE,
+							   stderr=subprocess.PIPE, universal_newlines=True)
+	out, err = process.communicate()
+
+	if process.returncode != 0:
+		raise IOError("xrdfs {0} failed: {1}".format(args[0], err.strip()))
+
+	return out
+
 def EosMove( initial_file, destination_file ):
-	
+	"""
+	Renames the file on the EOS server and returns its adler32 checksum, as computed by EOS.
+	"""
 	destination_dir = os.path.dirname(destination_file)
-	
+
 	if not os.path.isdir(destination_dir):
-		os.system("xrdfs root://eoslhcb.cern.ch/ mkdir -p {0}".format( destination_dir ))
-		
-	os.system("xrdfs root://eoslhcb.cern.ch/ mv {0} {1}".format( initial_file, destination_file ))
\ No newline at end of file
+		XrdFs("mkdir", "-p", destination_dir)
+
+	XrdFs("mv", initial_file, destination_file)
+
+	return ParseChecksum(XrdFs("query", "checksum", destination_file))
+
+def HasXRootD():
+	try:
+		from XRootD import client
+		return True
+	except ImportError:
+		return False
+
+
+class EosSession(object):
+	"""
+	One XRootD session on the EOS server shared by the mover threads, the destination
+	directories are only created once.
+	"""
+
+	def __init__(self, url=EOS_URL):
+		self.url = url
+		self.lock = threading.Lock()
+		self.dirs = set()
+		self._fs = None
+
+	@property
+	def fs(self):
+		with self.lock:
+			if self._fs is None:
+				from XRootD import client
+				self._fs = client.FileSystem(self.url)
+		return self._fs
+
+	def makedirs(self, directory):
+		if directory in self.dirs:
+			return
+
+		from XRootD.client.flags import MkDirFlags
+		status, _ = self.fs.mkdir(directory, MkDirFlags.MAKEPATH)
+		if not status.ok:
+			exists, _ = self.fs.stat(directory)
+			if not exists.ok:
+				raise IOError("mkdir {0} failed: {1}".format(directory, status.message))
+		self.dirs.add(directory)
+
+	def move(self, initial_file, destination_file):
+		"""
+		Renames the file on the server, returns its adler32 checksum as computed by EOS.
+		"""
+		self.makedirs(os.path.dirname(destination_file))
+		status, _ = self.fs.mv(initial_file, destination_file)
+		if not status.ok:
+			raise IOError("mv {0} failed: {1}".format(initial_file, status.message))
+
+		from XRootD.client.flags import QueryCode
+		status, response = self.fs.query(QueryCode.CHECKSUM, destination_file)
+		if not status.ok:
+			return None
+		return ParseChecksum(response.decode("utf-8", "replace"))
+
+
+class MoverService(object):
+	"""
+	Moves the outputs of the completed subjobs in a bounded pool of threads, so that a
+	status refresh does not wait for them. The moves of a subjob are queued together under
+	a key, e.g. (jobnumber, subjobnumber), and their results, {destination: {"error": error
+	or None, "adler32": checksum or None if the file was renamed}}, with the error of the cleanup under CLEANUP, are kept
+	until collected.
+	"""
+
+	def __init__(self, nthreads=MOVER_THREADS):
+		self.nthreads = nthreads
+		self.executor = None
+		self.lock = threading.Lock()
+		self.pending = {}
+		self.results = {}
+		self._eos = None
+
+	@property
+	def eos(self):
+		if self._eos is None and HasXRootD():
+			self._eos = EosSession()
+		return self._eos
+
+	def move(self, initial_file, destination_file):
+		if "eos" not in initial_file:
+			return Move(initial_file, destination_file)
+		elif self.eos is not None:
+			return self.eos.move(initial_file, destination_file)
+		else:
+			return EosMove(initial_file, destination_file)
+
+	def submit(self, key, moves, cleanup=None):
+		"""
+		Queues the moves, [(initial_file, destination_file)], of key. cleanup is called
+		once all the moves succeeded. Returns False if moves of key are already pending.
+		"""
+		with self.lock:
+			if key in self.pending:
+				return False
+
+			if ThreadPoolExecutor is None:
+				self.pending[key] = None
+			else:
+				if self.executor is None:
+					self.executor = ThreadPoolExecutor(max_workers=self.nthreads)
+				self.pending[key] = self.executor.submit(self._run, key, moves, cleanup)
+				return True
+
+		self._run(key, moves, cleanup)
+		return True
+
+	def _run(self, key, moves, cleanup):
+		results = {}
+
+		for initial_file, destination_file in moves:
+			try:
+				with record("move"):
+					checksum = self.move(initial_file, destination_file)
+				results[destination_file] = {"error": None, "adler32": checksum}
+			except Exception as err:
+				results[destination_file] = {"error": str(err), "adler32": None}
+
+		if cleanup is not None and all(result["error"] is None for result in results.values()):
+			try:
+				cleanup()
+			except Exception as err:
+				results[CLEANUP] = {"error": str(err), "adler32": None}
+
+		with self.lock:
+			self.pending.pop(key, None)
+			self.results[key] = results
+
+	def ismoving(self, key):
+		# until the results are collected
+		with self.lock:
+			return key in self.pending or key in self.results
+
+	def collect(self):
+		"""
+		Results of the moves done since the last call, {key: {destination: result}}.
+		"""
+		with self.lock:
+			results, self.results = self.results, {}
+		return results
+
+	def wait(self):
+		with self.lock:
+			futures = [future for future in self.pending.values() if future is not None]
+		for future in futures:
+			future.result()
+
+_mover = None
+
+def getmover():
+	"""
+	Mover service shared by all the jobs of the session.
+	"""
+	global _mover
+	if _mover is None:
+		_mover = MoverService()
+	return _mover
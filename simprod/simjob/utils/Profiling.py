@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+## Description: opt-in instrumentation of the hot paths, enabled by setting the environment
+## variable SIMPROD_PROFILE (e.g. SIMPROD_PROFILE=1). The wall time and the number of calls
+## are recorded for the batch system commands, the database flushes, the file probes and
+## the file moves. When it is not set, the probes are the plain functions.
+
+import os
+import time
+import functools
+import threading
+import json as js
+
+ENABLED = os.getenv("SIMPROD_PROFILE", "").lower() not in ["", "0", "false", "no"]
+
+class Profiler(object):
+	"""
+	Wall time and number of calls per instrumented operation.
+	"""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.stats = {}
+			self.start = time.time()
+
+	def add(self, name, elapsed):
+		with self.lock:
+			stat = self.stats.get(name)
+			if stat is None:
+				stat = self.stats[name] = [0, 0.]
+			stat[0] += 1
+			stat[1] += elapsed
+
+	def record(self, name):
+		return Record(self, name)
+
+	def wrap(self, name, func):
+
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			start = time.time()
+			try:
+				return func(*args, **kwargs)
+			finally:
+				self.add(name, time.time() - start)
+
+		return wrapper
+
+	def todict(self):
+		with self.lock:
+			stats = {}
+			for name, (calls, seconds) in self.stats.items():
+				stats[name] = {"calls": calls, "seconds": seconds, "ms_per_call": seconds * 1e3 / calls}
+			return {"elapsed": time.time() - self.start, "stats": stats}
+
+	def summary(self):
+		profile = self.todict()
+		stats = sorted(profile["stats"].items(), key=lambda s: s[1]["seconds"], reverse=True)
+
+		toprint = []
+		toprint.append("{0:.1f} s profiled".format(profile["elapsed"]))
+		header = "{0:>20} |{1:>10} |{2:>12} |{3:>12} |".format("operation", "calls", "total [s]", "per call [ms]")
+		line = "-" * len(header)
+		toprint += [line, header, line]
+		for name, stat in stats:
+			toprint.append("{0:>20} |{1:>10} |{2:>12.3f} |{3:>12.3f} |".format(name, stat["calls"], stat["seconds"],
+			                                                                   stat["ms_per_call"]))
+		return "\n".join(toprint)
+
+	def dump(self, dumpfile):
+		with open(dumpfile, "w") as f:
+			js.dump(self.todict(), f, indent=2, sort_keys=True)
+
+
+class Record(object):
+
+	def __init__(self, profiler, name):
+		self.profiler = profiler
+		self.name = name
+
+	def __enter__(self):
+		self.start = time.time()
+
+	def __exit__(self, *args):
+		self.profiler.add(self.name, time.time() - self.start)
+		return False
+
+
+class NoRecord(object):
+
+	def __enter__(self):
+		pass
+
+	def __exit__(self, *args):
+		return False
+
+_norecord = NoRecord()
+
+profiler = Profiler()
+
+def record(name):
+	"""
+	Context manager timing its block as the operation name.
+	"""
+	if ENABLED:
+		return profiler.record(name)
+	else:
+		return _norecord
+
+def profiled(name, func=None):
+	"""
+	Decorator timing the calls of a function as the operation name, or the wrapped function
+	if func is given.
+	"""
+	def decorate(func):
+		if ENABLED:
+			return profiler.wrap(name, func)
+		else:
+			return func
+
+	if func is not None:
+		return decorate(func)
+	return decorate
+
+isfile = profiled("isfile", os.path.isfile)
+getsize = profiled("getsize", os.path.getsize)
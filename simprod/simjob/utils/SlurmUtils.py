@@ -7,71 +7,162 @@ from subprocess import Popen, PIPE
 from datetime import datetime
 import os
 import getpass
+import shutil
 from .utilities import *
 import time
 import sys
 from .submit import main as submit
-from .ScreenUtils import *
-from tinydb import TinyDB, JSONStorage
-from tinydb.middlewares import CachingMiddleware
-from random import randint
+from .submit import PrepareSlurmJob, SendCommand
+from .Submitter import SubmissionQueue, Submitter, simprodfile
 from .Status import Status
-from .ScreenUtils import SendInScreen, KillScreenSession
+from .Profiling import record
 
 DEBUG = 0
 
-try:
-	import pyslurm
-	haspyslurm = True
-except ImportError:
-	haspyslurm = False
+if sys.version_info[0] > 2:
+	from importlib import reload
+
+SITECONFIG = {"module": "SimulationLPHEConfig",
+			  "file": "/share/lphe/home/marinang/SimulationLPHEConfig.py",
+			  "dir": "/share/lphe/home/marinang/"}
 
 def Kill( ID ):
 	
 	kill = Popen(['scancel',str(ID)], stdout=PIPE, stderr=PIPE)
 	_, _ = kill.communicate()
 			
-def GetStatus( ID ):
-
-	if haspyslurm:
-		try:
-			j = pyslurm.job()
-			j = j.find_id(str(ID))[0]
-			status = j["job_state"].lower()
-		except ValueError:
-			status = "notfound"
-			
-	else:
-		
-		command = ["squeue", "--job", str(ID), "-o", "'%T"]
-		
+SLURM_STATES = {"PENDING": "submitted", "CONFIGURING": "submitted", "REQUEUED": "submitted",
+				"RESIZING": "submitted", "RUNNING": "running", "COMPLETING": "running",
+				"COMPLETED": "completed", "SUSPENDED": "cancelled", "CANCELLED": "cancelled",
+				"STOPPED": "cancelled", "PREEMPTED": "cancelled", "FAILED": "failed",
+				"TIMEOUT": "failed", "NODE_FAIL": "failed", "OUT_OF_MEMORY": "failed",
+				"BOOT_FAIL": "failed", "DEADLINE": "failed"}
+				
+SACCT_CHUNK = 500 #job ids per sacct call
+				
+def SlurmState( state ):
+	# sacct reports e.g. "CANCELLED by 1234"
+	state = state.split(" ")[0].upper()
+	return SLURM_STATES.get(state, "notfound")
+	
+def RunCommand( command ):
+	
+	with record(command[0]):
 		if sys.version_info[0] > 2:	
 			process  = Popen(command, stdout=PIPE, stderr=PIPE, encoding='utf8')
 		else:
 			process  = Popen(command, stdout=PIPE, stderr=PIPE)
-		
+			
 		out, err = process.communicate()
-					
-		if "slurm_load_jobs error: Invalid job id specified" in err:
-			status = "notfound"
-		else:
-			try:
-				status = out.split("\n")[1].replace("'","").lower()
+	
+	if process.returncode != 0:
+		print(red("'{0}' failed: {1}".format(" ".join(command[:1]), err.strip())))
+		return None
+	return out
+	
+def QueueStates( ):
+	"""
+	States of all the jobs of the user in the queue, {jobid: state}.
+	"""
+	# -r: one line per task of job arrays
+	out = RunCommand(["squeue", "-u", getpass.getuser(), "-h", "-r", "-o", "%i %T"])
+	if out is None:
+		return None
+		
+	states = {}
+	for line in out.split("\n"):
+		line = line.split()
+		if len(line) == 2:
+			states[line[0]] = SlurmState(line[1])
+	return states
+	
+def AccountingStates( IDs ):
+	"""
+	States of jobs which have left the queue, {jobid: state}.
+	"""
+	IDs = list(IDs)
+	states = {}
+	for i in range(0, len(IDs), SACCT_CHUNK):
+		command = ["sacct", "-j", ",".join(IDs[i:i+SACCT_CHUNK]), "-X", "-n", "-P", "-o", "JobID,State"]
+		out = RunCommand(command)
+		if out is None:
+			return None
+		for line in out.split("\n"):
+			line = line.split("|")
+			if len(line) == 2:
+				states[line[0].strip()] = SlurmState(line[1].strip())
+	return states
+	
+class StatusCache(object):
+	"""
+	Status of the tracked slurm jobs, refreshed with one squeue call per cycle and one
+	sacct call for the jobs which have left the queue since the previous cycle.
+	"""
+	
+	def __init__(self, ttl=60):
+		self.ttl = ttl #seconds, lifetime of a squeue snapshot
+		self.tracked = set()
+		self.queue = {}
+		self.finished = {}
+		self.creation_time = None
+		
+	@property
+	def isvalid(self):
+		return self.creation_time is not None and time.time() - self.creation_time < self.ttl
+		
+	def track(self, IDs):
+		new = set(str(ID) for ID in IDs if ID is not None) - self.tracked
+		self.tracked.update(new)
+		if self.isvalid:
+			# the jobs tracked after the snapshot are checked with one sacct call
+			self.update_finished(new)
+		
+	def refresh(self):
+		queue = QueueStates()
+		if queue is None:
+			return False
+		self.queue = queue
+		self.creation_time = time.time()
+		self.update_finished(self.tracked)
+		return True
+		
+	def update_finished(self, IDs):
+		departed = [ID for ID in IDs if ID not in self.queue and ID not in self.finished]
+		if len(departed) == 0:
+			return
+		states = AccountingStates(departed)
+		if states is None:
+			return
+		for ID in departed:
+			# jobs unknown to sacct are out of its retention window
+			state = states.get(ID, "notfound")
+			if state not in ["submitted", "running"]:
+				self.finished[ID] = state
+		
+	def get(self, ID):
+		ID = str(ID)
+		
+		if ID not in self.tracked:
+			self.tracked.add(ID)
+			if self.isvalid:
+				self.update_finished([ID])
 				
-				if status == "pending":
-					status = "pending"
-				elif status in ["runnning", "completing"]:
-					status = "running"
-				elif status == "completed":
-					status = "completed"
-				elif status in ["suspended", "cancelled", "stopped"]:
-					status = "cancelled"
-				elif status in ["failed", "timeout"]:
-					status = "failed"
-			except IndexError:
-				status = "pending"
-
-	return status
+		if not self.isvalid:
+			if not self.refresh():
+				return "error"
+			
+		if ID in self.queue:
+			return self.queue[ID]
+		else:
+			return self.finished.get(ID, "error")
+			
+_statuscache = StatusCache()
+	
+def SiteConfigFile():
+	if "lphe" in os.getenv("HOSTNAME", ""):
+		return SITECONFIG["file"]
+	else:
+		return None
 	
 def GetConfig():
 	if DEBUG > 1:
@@ -79,13 +170,14 @@ def GetConfig():
 		
 	def_config = DefaultSlurmConfig() 
 	
-	if "lphe" in os.getenv("HOSTNAME"):
+	configfile = SiteConfigFile()
+	
+	if configfile is not None:
 		
 		if DEBUG > 1:
 			print("LPHE")
 		
-		configfile = "/share/lphe/home/marinang/SimulationLPHEConfig.py"
-		configdir  = "/share/lphe/home/marinang/"
+		configdir  = SITECONFIG["dir"]
 		if os.path.isfile(configfile):
 			
 			if "SimulationLPHEConfig" in sys.modules:
@@ -103,6 +195,9 @@ def GetConfig():
 	else:
 		config = def_config
 		
+	for option, value in def_config.items():
+		config.setdefault(option, value)
+		
 	if DEBUG > 1:
 		print("New config:")
 		print(config)
@@ -148,63 +243,150 @@ def DefaultSlurmConfig( ):
 	config["cpumemory"] = 2800
 	config["totmemory"] = 4140
 	config["time"] = 20
+	config["jobarray"] = True
+	config["narraytasks"] = int(nsimuserjobs)
 			
 	return config
 	
+def ConfigKey( ):
+	"""
+	What the slurm config depends on: the day/night and weekday/weekend windows of
+	DefaultSlurmConfig and the modification time of the site config file.
+	"""
+	now = datetime.now()
+	day = now.hour > 5 and now.hour < 22
+	weekend = now.weekday() == 5 or now.weekday() == 6
+	
+	configfile = SiteConfigFile()
+	if configfile is not None and os.path.isfile(configfile):
+		mtime = os.path.getmtime(configfile)
+	else:
+		mtime = None
+		
+	return (day, weekend, configfile, mtime)
+	
+_config = {"key": None, "config": None}
+	
 def DefaultSlurmOptions( ):
 	
-	config = GetConfig()
+	key = ConfigKey()
+	if key != _config["key"]:
+		_config["config"] = GetConfig()
+		_config["key"] = key
+		
+	# copy, the lists of the options must not be shared between clerks
+	config = {}
+	for option, value in _config["config"].items():
+		config[option] = list(value) if isinstance(value, list) else value
 	return config
 				
-def SubCondition(Options):
+def InSubTime(subtime, hour):
+	ti, tf = subtime[0], subtime[1]
+	if ti <= tf:
+		return ti <= hour <= tf
+	else:
+		return hour >= ti or hour <= tf
 	
-	user = getpass.getuser()
+class Throttle(object):
+	"""
+	Submission conditions of the slurm batch system. The counters of jobs are taken from
+	one squeue snapshot per interval and incremented locally for each submitted job, the
+	number of jobs which can be sent is the smallest margin to the limits of the options.
+	When no job can be sent the throttle waits with a backoff growing from `minwait` to
+	`maxwait` seconds.
+	"""
 	
-	if DEBUG > 0:
-		print("In SubCondition")
-		print(Options)
+	def __init__(self, interval=60, minwait=15, maxwait=600):
+		self.interval = interval #seconds, lifetime of a squeue snapshot
+		self.minwait = minwait
+		self.maxwait = maxwait
+		self.counts = None
+		self.creation_time = None
 		
-	#additionnal submission conditions for SLURM batch system 
+	@property
+	def isvalid(self):
+		return self.creation_time is not None and time.time() - self.creation_time < self.interval
 		
-	ti, tf = Options['subtime'][0], Options['subtime'][1]
-	if ti < tf:
-		allowed_time = range(ti,tf+1)
-	elif tf < ti:
-		allowed_time = range(ti,24) + range(0,tf+1)
+	def snapshot(self):
+		out = RunCommand(["squeue", "-h", "-r", "-o", "%u %j %T"])
+		if out is None:
+			return False
 			
+		user = getpass.getuser()
+		counts = {"simjobs_user": 0, "simjobs_total": 0, "jobs_user": 0, "pendjobs_user": 0}
+		for line in out.split("\n"):
+			line = line.split()
+			if len(line) != 3:
+				continue
+			juser, jname, jstate = line
+			simjob = "simProd" in jname
+			counts["simjobs_total"] += simjob
+			if juser == user:
+				counts["simjobs_user"] += simjob
+				counts["jobs_user"] += 1
+				counts["pendjobs_user"] += jstate == "PENDING"
 				
-	Nsimjobs_user  = int( os.popen( "echo $(squeue -u {0} | grep -c 'simProd')".format(user) ).read() )
-	Nsimjobs_total = int( os.popen( "echo $(squeue | grep -c 'simProd')"                     ).read() )
-	Njobs_user     = int( os.popen( "echo $(squeue  | grep -c '{0}')".format(user)           ).read() )
-	Npendjobs_user = int( os.popen( "echo $(squeue -u {0} | grep -c 'PD')".format(user)      ).read() )
-	
-	now = datetime.now()
-	hour = now.hour
+		self.counts = counts
+		self.creation_time = time.time()
+		return True
+		
+	def capacity(self, Options, verbose=True):
+		"""
+		Number of jobs which can be sent now.
+		"""
+		if not InSubTime(Options['subtime'], datetime.now().hour):
+			if verbose:
+				print( red("Jobs are sent between {0}h and {1}h!".format(*Options['subtime'])) )
+			return 0
+			
+		if not self.isvalid and not self.snapshot():
+			return 0
+			
+		margins = [(Options['nsimuserjobs'] - self.counts["simjobs_user"],
+					"You have already submitted {0} simulation jobs. Wait for submission!".format(self.counts["simjobs_user"])),
+				   (Options['nsimjobs'] - self.counts["simjobs_total"],
+					"{0} simulation jobs are submitted. Wait for submission!".format(self.counts["simjobs_total"])),
+				   (Options['nuserjobs'] - self.counts["jobs_user"],
+					"You have already submitted {0} jobs. Wait for submission!".format(self.counts["jobs_user"])),
+				   (Options['npendingjobs'] - self.counts["pendjobs_user"],
+					"You have already {0} jobs pending. Wait for submission!".format(self.counts["pendjobs_user"]))]
+					
+		for margin, msg in margins:
+			if margin <= 0:
+				if verbose:
+					print( red(msg) )
+				return 0
+				
+		return int(min(margin for margin, _ in margins))
+		
+	def consume(self, njobs=1):
+		# the submitted jobs are pending until the next snapshot
+		for counter in self.counts:
+			self.counts[counter] += njobs
+		
+	def acquire(self, Options):
+		"""
+		Waits until one job can be sent and takes its place.
+		"""
+		wait = self.minwait
+		verbose = True
+		while self.capacity(Options, verbose) < 1:
+			verbose = False
+			time.sleep(wait)
+			wait = min(2 * wait, self.maxwait)
+			self.creation_time = None
+		self.consume()
+		
+_throttle = Throttle()
+				
+def SubCondition(Options):
 	
-	#conditions
-	time          = hour in allowed_time
-	simjobs_total = Options['nsimjobs'] <= Nsimjobs_total     
-	simjobs_user  = Options['nsimuserjobs'] <= Nsimjobs_user  
-	jobs_user     = Options['nuserjobs'] <= Njobs_user        
-	pendjobs_user = Options['npendingjobs'] <= Npendjobs_user
-			
-	if not time:
-		print( red("Jobs are sent between {0}h and {1}h!".format(ti, tf)) )
-		Submission = False
-	elif simjobs_user:
-		print( red("You have already submitted {0} simulation jobs. Wait for submission!".format(Nsimjobs_user)) )
-		Submission = False
-	elif simjobs_total:
-		print( red("{0} simulation jobs are submitted. Wait for submission!".format(Nsimjobs_total)) )
-		Submission = False
-	elif jobs_user:
-		print( red("You have already submitted {0} jobs. Wait for submission!".format(Njobs_user)) )
-		Submission = False
-	elif pendjobs_user:
-		print( red("You have already {0} jobs pending. Wait for submission!".format(Npendjobs_user)) )
-		Submission = False
-	elif time and not simjobs_user and not simjobs_total and not jobs_user and not pendjobs_user:
-		Submission = True
+	if DEBUG > 0:
+		print("In SubCondition")
+		print(Options)
+		
+	#additionnal submission conditions for SLURM batch system 
+	Submission = _throttle.capacity(Options) > 0
 		
 	if DEBUG > 0:
 		print("Out of SubCondition\n")
@@ -225,20 +407,20 @@ class DeliveryClerk(object):
 		options["subtime"] = kwargs.get("subtime", [0, 23])
 		
 		parameters = ["nsimjobs", "nuserjobs", "npendingjobs", "nfreenodes", "nodestoexclude",
-					  "cpumemory", "totmemory", "nsimuserjobs", "time"]
+					  "cpumemory", "totmemory", "nsimuserjobs", "time", "jobarray", "narraytasks"]
+					
+		default_options = self.default_options
 					
 		for p in parameters:
-			options[p] = kwargs.get(p, self.default_options[p])
+			options[p] = kwargs.get(p, default_options[p])
 			if DEBUG > 1:
-				print(p, options[p], self.default_options[p])
+				print(p, options[p], default_options[p])
 			if kwargs.get(p, None) is None:
 				self.defaults.append(p)
 				
 		if DEBUG > 1:
 			print("defaults", self.defaults)
 		
-		self.screensessions = []
-		
 		self._options = options
 		
 		self.inscreen = kwargs.get("inscreen", False)
@@ -254,8 +436,9 @@ class DeliveryClerk(object):
 		if DEBUG > 0:
 			print("In DeliveryClerk.options update")
 			print(self._options)
+		default_options = self.default_options
 		for opt in self.defaults:
-			self._options[opt] = self.default_options[opt]
+			self._options[opt] = default_options[opt]
 		if DEBUG > 0:
 			print(self._options)
 			print("Out DeliveryClerk.options update\n")
@@ -269,13 +452,17 @@ class DeliveryClerk(object):
 	def default_options(self):
 		return DefaultSlurmOptions()
 		
+	@property
+	def maxruntime(self):
+		# minutes, the time option is in hours
+		return self.options["time"] * 60
+		
 	def outdict(self):
-		return {"options": self.options, "screensessions": self.screensessions, "defaults": self.defaults}
+		return {"options": self.options, "defaults": self.defaults}
 		
 	@classmethod
 	def from_dict(cls, dict, **kwargs):
 		deliveryclerk = cls(**dict["options"])	
-		deliveryclerk.screensessions = dict["screensessions"]	
 		deliveryclerk.defaults = dict["defaults"]
 		
 		return deliveryclerk
@@ -289,124 +476,193 @@ class DeliveryClerk(object):
 		options["nodestoexclude"] = self.options["nodestoexclude"]
 		options["slurm"] = True
 		return options
+		
+	def subjob_send_options(self, subjob):
+		send_options = subjob.send_options
+		command = subjob.command()["doprod"] + " "
+		command += " ".join(str(a) for a in subjob.command()["args"])
+		send_options["command"] = command
+		send_options["slurm"] = True
+		return self.new_send_options(send_options)
 			
 	def send_job(self, job, storage, *args, **kwargs):
 		
-		if self.inscreen:
+		if not self.inscreen and self.options["jobarray"] and SubCondition(self.options):
+			if self.send_array(job):
+				return
+			print(red("Job array submission failed, the subjobs are submitted one by one."))
+		
+		if self.inscreen or job.jobnumber is None:
 			for n in job.range_subjobs:	
 				job[n].send()
 		else:
+			self.queue_job(job)
 			
-			storage.flush()
+	def queue_job(self, job):
+		"""
+		Puts the subjobs to send in the queue of the submission daemon, started if needed.
+		"""
 		
-			cmdpy = screencommandfile(job)
+		if len(job.keys) == 0:
+			job.prepare()
 			
-			screename = cmdpy.replace(".py","")
-			screename = screename.replace(os.path.dirname(screename)+"/","")
-
-			_id = SendInScreen( screename, cmdpy)
-
-			print(red("Job submission is done in a screen session!"))
-
-			self.screensessions.append({"name":screename, "id":_id})
+		queue = getqueue()
+		nqueued = 0
+		for n in job.range_subjobs:
+			sj = job[n]
+			if sj._status.submitted and not sj._status.failed:
+				continue
+			if sj._status.failed:
+				sj.reset()
+			queue.put(job.jobnumber, n, sj.runnumber, self.subjob_send_options(sj), self.options)
+			# invalid status, the jobid is taken from the queue at the next update of the job
+			sj._status = Status("new", sj.output, in_init=True, inventory=sj.inventory)
+			nqueued += 1
 			
-					
-	def send_subjob(self, subjob):
-
-		SUBMIT = False
-		while SUBMIT is False:	
-			SUBMIT = SubCondition(self.options)
-			if not SUBMIT:
-				time.sleep(randint(0, 20) * 60)
+		Submitter.start()
 		
-		if not subjob._status.submitted or subjob._status.failed:
-			if subjob._status.failed:
-				subjob.reset()
+		print(red("{0} subjobs are queued, they are sent by the submission daemon!".format(nqueued)))
 			
-			send_options = subjob.send_options
-			command = subjob.command()["doprod"] + " "
-			command += " ".join(str(a) for a in subjob.command()["args"])
-			send_options["command"] = command
-			send_options["slurm"] = True
-			send_options = self.new_send_options(send_options)
-			subjobid = submit(**send_options)
+					
+	def send_array(self, job):
+		"""
+		Submits all the subjobs to send as one slurm job array, the index of a task being the
+		subjob number. Returns False if the submission failed.
+		"""
+		
+		if len(job.keys) == 0:
+			job.prepare()
 			
-			return subjobid		
+		subjobs = []
+		for n in job.range_subjobs:
+			sj = job[n]
+			if sj._status.submitted and not sj._status.failed:
+				continue
+			if sj._status.failed:
+				sj.reset()
+				# the jobid of the previous submission is not taken from the queue again
+				getqueue().discard(job.jobnumber, n)
+			subjobs.append(sj)
+			
+		if len(subjobs) == 0:
+			return True
 			
-	def send_subjob_inscreen(self, subjob, storage):
+		proddir = job.proddir
+		if not os.path.exists(proddir):
+			os.makedirs(proddir)
+			
+		doprod = "{0}/{1}".format(proddir, os.path.basename(job.doprod))
+		shutil.copyfile(job.doprod, doprod)
+		
+		# tasks still pending from a previous array keep reading their own task file
+		name = "{0}/array_{1}_{2}".format(proddir, job.jobnumber, int(time.time()))
+		taskfile = name + ".tasks"
+		runfile = name + ".sh"
+		
+		with open(taskfile, "w") as tasks:
+			for sj in subjobs:
+				if os.path.exists(sj.jobdir):
+					silentrm(sj.jobdir)
+				os.makedirs(sj.jobdir)
+				for f in sj.infiles:
+					shutil.copyfile(f, "{0}/{1}".format(sj.jobdir, os.path.basename(f)))
+				args = " ".join(str(a) for a in sj.command()["args"])
+				tasks.write("{0} {1} {2}\n".format(sj.subjobnumber, sj.jobdir, args))
+				
+		with open(runfile, "w") as run:
+			run.write("#!/bin/bash\n")
+			run.write("task=$(awk -v id=$SLURM_ARRAY_TASK_ID '$1 == id' {0})\n".format(taskfile))
+			run.write("read -r sjn dirname args <<< \"$task\"\n")
+			run.write("cd $dirname\n")
+			run.write("exec > $dirname/out 2> $dirname/err\n")
+			run.write("chmod 755 {0}\n".format(doprod))
+			run.write("{0} $args\n".format(doprod))
+		os.chmod(runfile, 0o775)
+		
+		array = ArrayIndices([sj.subjobnumber for sj in subjobs])
+		if self.options["narraytasks"] > 0:
+			array += "%{0}".format(self.options["narraytasks"])
+			
+		send_options = self.new_send_options(job.options)
+		send_options.update(dirname=proddir, runfile=runfile, jobname="_job{0}".format(job.jobnumber),
+							array=array, output="/dev/null", error="/dev/null")
 		
-		if DEBUG > 1:
-			print("In DeliveryClerk.send_subjob_inscreen:")
+		print(blue("Submitting job array: ...."))
+		out = SendCommand(PrepareSlurmJob(**send_options))
+		try:
+			ArrayID = int(out.split(" ")[-1])
+		except (ValueError, IndexError):
+			print(red(out))
+			return False
+		print(blue("Submitted batch job {0}".format(ArrayID)))
+		
+		_throttle.consume(len(subjobs))
+		
+		with job.batch():
+			for sj in subjobs:
+				sj.jobid = "{0}_{1}".format(ArrayID, sj.subjobnumber)
+				sj._status = Status("submitted", sj.output, inventory=sj.inventory)
+				sj._update_subjob_table()
+				
+		return True
 		
-		subjobid = None
-	
-		SUBMIT = False
-		while SUBMIT is False:
-			SUBMIT = SubCondition(self.options)
-			if not SUBMIT:
-				storage.flush()
-				time.sleep(randint(0, 20) * 60)
+	def send_subjob(self, subjob):
+
+		_throttle.acquire(self.options)
 		
 		if not subjob._status.submitted or subjob._status.failed:
 			if subjob._status.failed:
 				subjob.reset()
+				getqueue().discard(subjob.parent.jobnumber, subjob.subjobnumber)
 			
-			send_options = subjob.send_options
-			command = subjob.command()["doprod"] + " "
-			command += " ".join(str(a) for a in subjob.command()["args"])
-			send_options["command"] = command
-			send_options["slurm"] = True
-			send_options = self.new_send_options(send_options)
-			subjobid = submit(**send_options)
-				
-			subjob.jobid = subjobid
+			subjobid = submit(**self.subjob_send_options(subjob))
 			
-			if subjob.jobid:
-				subjob._status = Status("submitted", subjob.output)
-					
-				time.sleep(0.07)
-				print(blue("{0}/{1} jobs submitted!".format(subjob.subjobnumber, subjob.parent.nsubjobs)))
-				time.sleep(0.07)				
-			else:
-				print(red("job {0}/{1} submission failed, try later!".format(subjob.subjobnumber, subjob.parent.nsubjobs)))
+			return subjobid		
 			
-			subjob._update_subjob_table()
-
-		
 	def get_update_subjobs(self, job):
 		
-		simprod = os.getenv("SIMPRODPATH")
-		name = "job_{0}".format(job.jobnumber)	
-		fname = simprod + "/" + name + ".json"
-		
-		if os.path.isfile(fname):
-			DATABASE = getdatabase(fname)
-			table = DATABASE.table(name)
-			DATABASE.close()
-			return table
-		else:
+		queue = getqueue()
+		rows = queue.subjobs(job.jobnumber)
+		if len(rows) == 0:
 			return None
 			
+		if any(sj["state"] == "queued" for sj in rows.values()):
+			# e.g. queued while the previous daemon was stopping
+			Submitter.start()
+			
+		table = {}
+		for n, sj in rows.items():
+			if sj["state"] == "submitted":
+				jobid = int(sj["jobid"]) if sj["jobid"].isdigit() else sj["jobid"]
+				if job[n].jobid == jobid:
+					# applied to the subjob document at a previous update
+					queue.discard(job.jobnumber, n, "submitted")
+					continue
+				table[n] = {"runnumber": sj["runnumber"], "jobid": jobid, "status": "submitted"}
+			elif sj["state"] == "failed":
+				# the subjob is marked failed, to be sent again with the failed ones
+				print(red("subjob {0}.{1} could not be sent, see {2}".format(job.jobnumber, n,
+																			 simprodfile("submitter.log"))))
+				table[n] = {"runnumber": sj["runnumber"], "jobid": None, "status": "failed"}
+				
+		if any(sj["state"] == "failed" for sj in rows.values()):
+			queue.remove(job.jobnumber, "failed")
+			
+		return table if len(table) > 0 else None
+			
+	def track(self, IDs):
+		_statuscache.track(IDs)
+		
 	def getstatus(self, ID):
-		return GetStatus(ID)
+		return _statuscache.get(ID)
 			
 	def clear(self, job):
-
-		simprod = os.getenv("SIMPRODPATH")
-		name = "{0}/job_{1}".format(simprod, job.jobnumber)	
-		dbname = name + ".json"
-		pyname = name + ".py"
-
-		if os.path.isfile(dbname):
-			os.remove(dbname)
-		if os.path.isfile(pyname):
-			os.remove(pyname)
+		getqueue().remove(job.jobnumber)
 			
 			
 	def kill(self, **kwargs):
-		for sc in self.screensessions:
-			KillScreenSession(sc["name"])	
-			self.screensessions = []
+		# the subjobs not sent yet are taken out of the queue
+		getqueue().remove(kwargs["job"].jobnumber, "queued", "failed")
 		return True
 		
 	def killsubjob(self, ID):
@@ -434,76 +690,26 @@ class DeliveryClerk(object):
 		self.__dict__[var] = getattr(DeliveryClerk, var)
 		
 	
-def getdatabase(file):
-	storage = CachingMiddleware(JSONStorage)
-	storage.WRITE_CACHE_SIZE = 20
-	return TinyDB(file, storage=storage)
-			
-def screencommandfile(job):
-	
-	simprod = os.getenv("SIMPRODPATH")
-		
-	name = "{0}/job_{1}".format(simprod, job.jobnumber)	
-	pyfile = name + ".py"
-	dbasefile = name + ".json"
-	if job.status == "new" and os.path.isfile(dbasefile):
-		os.remove(dbasefile)				
-	
-
-	f = open(pyfile, "w")
-	f.write("#!/usr/bin/python\n\n")
-	
-	f.write("import os\n")
-	f.write("import time\n")
-	f.write("from tinydb import TinyDB, JSONStorage, Query\n")
-	f.write("from tinydb.middlewares import CachingMiddleware\n")
-	f.write("os.environ['SIMPRODPATH'] = '{0}'\n".format(os.getenv("SIMPRODPATH")))
-	f.write("os.environ['SIMOUTPUT'] = '{0}'\n".format(os.getenv("SIMOUTPUT")))	                      
-	f.write("from simprod import *\n\n")
-				
-	f.write("time.sleep(1.5)\n\n")
+_queue = None
 
-	f.write("storage = CachingMiddleware(JSONStorage)\n")
-	f.write("storage.WRITE_CACHE_SIZE = 20\n")
-	f.write("jsonfile='{}'\n".format(dbasefile))
-	f.write("if os.path.isfile(jsonfile):\n")
-	f.write("\tos.remove(jsonfile)\n")
-	f.write("DATABASE = TinyDB(jsonfile, storage=storage)\n") 
-	
-	f.write("job_dict = {}\n".format(job.outdict()))
+def getqueue():
+	global _queue
+	if _queue is None:
+		_queue = SubmissionQueue()
+	return _queue
 			
-	f.write("job = SimulationJob.from_dict(job_dict, {})\n".format(job.jobnumber))
-	
-	f.write("job.database = DATABASE\n\n")
-	
-	if job.status == "new":
-		f.write("job.prepare(update_table=False)\n")
-		f.write("for n in job.range_subjobs:\n")
-		f.write("\tjob_dict = job[n].outdict()\n")
-		f.write("\tjob_dict['subjobnumber'] = n\n")
-		towrite = "\tjob.jobtable.upsert(job_dict, Query().runnumber"
-		towrite += " == job.getrunnumber(n))\n"
-		f.write(towrite)
-		towrite = "\tjob.deliveryclerk.send_subjob_inscreen(job[n], storage)\n"
-		f.write(towrite)
-	else:
-		for sj in job.select("new", update=False):
-			sjnum = sj.subjobnumber
-			towrite = "job_dict_{0} = {1}\n"
-			f.write(towrite.format(sjnum, sj.outdict()))
-			towrite = "job_dict_{0}['subjobnumber'] = {0}\n"
-			f.write(towrite.format(sjnum))
-			towrite = "job[{0}] = SimulationSubJob.from_dict(job, job_dict_{0}, {0}, to_store=False)\n"
-			f.write(towrite.format(sjnum))
-			towrite = "job.jobtable.upsert(job_dict_{0}, Query().runnumber"
-			towrite += " == job.getrunnumber({0}))\n"
-			f.write(towrite.format(sjnum))
-			towrite = "job.deliveryclerk.send_subjob_inscreen(job[{}], storage)\n\n"
-			f.write(towrite.format(sjnum))
-		
-	f.write("\n")
-	f.write("os.remove(__file__)\n\n")
-	f.write("DATABASE.close()\n")
-	f.close()
-	
-	return pyfile
+def ArrayIndices(numbers):
+	"""
+	Compact slurm array specification of a list of numbers, e.g. "1-10,12,15-20".
+	"""
+	numbers = sorted(numbers)
+	ranges = []
+	start = end = numbers[0]
+	for n in numbers[1:]:
+		if n == end + 1:
+			end = n
+			continue
+		ranges.append((start, end))
+		start = end = n
+	ranges.append((start, end))
+	return ",".join(str(a) if a == b else "{0}-{1}".format(a, b) for a, b in ranges)
@@ -6,7 +6,9 @@
 
 import glob
 import os
+import bisect
 from .utilities import *
+from .Profiling import isfile, getsize
 import time
 import subprocess
 import datetime
@@ -15,11 +17,14 @@ TIME_NEW = 60 #minutes, time between check of status if status is new
 TIME_RUNNING = 15
 TIME_FAILED = 35
 TIME_SUBMITTED = 5
+TTL_MIN = 1 #minutes, time between checks of a running subjob close to its expected end
+TTL_MAX = 120 #minutes, time between checks of a running subjob far from its expected end
+MIN_RUNTIMES = 3 #finished subjobs needed to estimate the run time from them
 DEBUG = 0
 
 class Status(object):
 	
-	def __init__(self, status, output, in_init=False):
+	def __init__(self, status, output, in_init=False, inventory=None):
 		
 		self.submitted = False
 		self.running = False
@@ -43,10 +48,16 @@ class Status(object):
 			self.finished = True
 			self.submitted = True
 							
-		if output != "" and os.path.isfile(output):							
-			if os.path.isfile(output) and os.path.getsize(output) >= 700000:
+		if inventory is not None:
+			# the output is looked up in the listing of its directory
+			_isfile, _getsize = inventory.isfile, inventory.getsize
+		else:
+			_isfile, _getsize = isfile, getsize
+							
+		if output != "" and _isfile(output):							
+			if _isfile(output) and _getsize(output) >= 700000:
 				self.completed = True
-			elif os.path.isfile(output) and os.path.getsize(output) < 700000:
+			elif _isfile(output) and _getsize(output) < 700000:
 				self.failed = True	
 			elif self.output == "":
 				self.failed = True
@@ -67,6 +78,7 @@ class Status(object):
 				self.status = "failed"
 		
 		self.creation_time = datetime.datetime.now()
+		self.ttl = None #minutes, set by a RefreshPolicy
 		
 		if DEBUG > 0:
 			print("In Status.__init__, status={0}, time={1}".format(status, self.creation_time))   
@@ -76,6 +88,10 @@ class Status(object):
 		
 		if self.in_init:
 			return False
+			
+		if self.ttl is not None:
+			elapsedTime = datetime.datetime.now() - self.creation_time
+			return elapsedTime.total_seconds() < self.ttl * 60
 
 		if self.status == "new":
 			delta = TIME_NEW
@@ -113,6 +129,50 @@ class Status(object):
 	def __repr__(self):
 		return self.status
 
+class RefreshPolicy(object):
+	"""
+	Time between two checks of the status of the subjobs of a job, adapted to when they are
+	expected to end. The expected run time is the median of the run times of the completed
+	subjobs of the job or, until enough of them have completed, the maximum run time asked
+	to the batch system. A running subjob is checked often close to its expected end and
+	rarely before.
+	"""
+	
+	def __init__(self, maxruntime=None, runtimes=()):
+		self.maxruntime = maxruntime #minutes
+		self.runtimes = sorted(runtimes)
+		
+	def addruntime(self, minutes):
+		bisect.insort(self.runtimes, minutes)
+		
+	@property
+	def expected(self):
+		if len(self.runtimes) >= MIN_RUNTIMES:
+			return self.runtimes[len(self.runtimes) // 2]
+		else:
+			return self.maxruntime
+			
+	def ttl(self, status, elapsed=None):
+		"""
+		Minutes before the next check of a subjob with status, running since elapsed minutes.
+		"""
+		if status != "running" or elapsed is None or self.expected is None:
+			return None
+			
+		remaining = self.expected - elapsed
+		if remaining > 0:
+			ttl = remaining / 4.
+		else:
+			# later than expected, checked less and less often
+			ttl = min(-remaining / 4., TIME_RUNNING)
+			
+		ttl = min(max(ttl, TTL_MIN), TTL_MAX)
+		
+		if DEBUG > 0:
+			print("In RefreshPolicy.ttl: expected={0}; elapsed={1}, ttl={2}".format(self.expected, elapsed, ttl))
+			
+		return ttl
+	
 def GetStatus(Job):
 	
 	JobID = Job["jobid"]
@@ -0,0 +1,241 @@
+#!/usr/bin/python
+
+## Description: submission daemon, the subjobs to send are put in a queue table and sent
+## by one background process serving all the jobs.
+
+import os
+import sys
+import time
+import fcntl
+import sqlite3
+import threading
+import subprocess
+import json as js
+
+from .utilities import *
+from .submit import main as submit
+
+DEBUG = 0
+
+POLL_INTERVAL = 5 #seconds, time between two reads of an empty queue
+IDLE_TIMEOUT = 600 #seconds, the daemon exits when the queue is empty for this long
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    job INTEGER NOT NULL,
+    subjob INTEGER NOT NULL,
+    runnumber INTEGER,
+    options TEXT,
+    conditions TEXT,
+    state TEXT,
+    jobid TEXT,
+    updated REAL,
+    PRIMARY KEY (job, subjob)
+);
+CREATE INDEX IF NOT EXISTS queue_state ON queue (state);
+"""
+
+def simprodfile(name):
+	return "{0}/{1}".format(os.getenv("SIMPRODPATH"), name)
+
+
+class SubmissionQueue(object):
+	"""
+	Queue of the subjobs to send. A subjob is "queued" until the daemon takes it,
+	"submitting" while it is sent, then "submitted" with its jobid or "failed".
+	"""
+
+	def __init__(self, path=None):
+		self.path = path or simprodfile("submissions.db")
+		# autocommit, the session and the daemon only hold the lock per statement. The connection
+		# is shared by the threads of the session (the shell and the background refresher).
+		self.lock = threading.RLock()
+		self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+		self.connection.executescript(SCHEMA)
+		
+	def execute(self, sql, params=()):
+		with self.lock:
+			return self.connection.execute(sql, params)
+			
+	def query(self, sql, params=()):
+		with self.lock:
+			return self.connection.execute(sql, params).fetchall()
+			
+	def count(self, sql, params=()):
+		# number of rows changed by the statement
+		with self.lock:
+			return self.connection.execute(sql, params).rowcount
+
+	def put(self, job, subjob, runnumber, options, conditions):
+		self.execute("INSERT OR REPLACE INTO queue VALUES (?, ?, ?, ?, ?, 'queued', NULL, ?)",
+								(job, subjob, runnumber, js.dumps(options), js.dumps(conditions), time.time()))
+
+	def next(self):
+		"""
+		Oldest queued subjob, None if the queue is empty.
+		"""
+		rows = self.query("SELECT job, subjob, options, conditions FROM queue "
+						  "WHERE state = 'queued' ORDER BY updated, job, subjob LIMIT 1")
+		if len(rows) == 0:
+			return None
+		job, subjob, options, conditions = rows[0]
+		return job, subjob, js.loads(options), js.loads(conditions)
+
+	def take(self, job, subjob):
+		# False if the subjob has been removed from the queue in the meantime
+		return self.setstate(job, subjob, "submitting", fromstate="queued")
+
+	def setstate(self, job, subjob, state, jobid=None, fromstate=None):
+		sql = "UPDATE queue SET state = ?, jobid = ?, updated = ? WHERE job = ? AND subjob = ?"
+		params = [state, jobid, time.time(), job, subjob]
+		if fromstate is not None:
+			sql += " AND state = ?"
+			params.append(fromstate)
+		return self.count(sql, params) == 1
+
+	def requeue(self, job, subjob):
+		# put back at the end of the queue, e.g. a subjob taken by a daemon which died
+		return self.setstate(job, subjob, "queued", fromstate="submitting")
+
+	def subjobs(self, job, *states):
+		sql = "SELECT subjob, runnumber, state, jobid FROM queue WHERE job = ?"
+		params = [job]
+		if states:
+			sql += " AND state IN ({0})".format(", ".join("?" * len(states)))
+			params += list(states)
+		rows = self.query(sql, params)
+		return {subjob: {"runnumber": runnumber, "state": state, "jobid": jobid}
+				for subjob, runnumber, state, jobid in rows}
+
+	def remove(self, job, *states):
+		sql = "DELETE FROM queue WHERE job = ?"
+		params = [job]
+		if states:
+			sql += " AND state IN ({0})".format(", ".join("?" * len(states)))
+			params += list(states)
+		return self.count(sql, params)
+
+	def discard(self, job, subjob, *states):
+		sql = "DELETE FROM queue WHERE job = ? AND subjob = ?"
+		params = [job, subjob]
+		if states:
+			sql += " AND state IN ({0})".format(", ".join("?" * len(states)))
+			params += list(states)
+		return self.count(sql, params)
+
+	def __len__(self):
+		return self.query("SELECT COUNT(*) FROM queue WHERE state = 'queued'")[0][0]
+
+	def close(self):
+		self.connection.close()
+
+
+class Submitter(object):
+	"""
+	The submission daemon. Only one runs at a time, it holds the lock of the file
+	$SIMPRODPATH/submitter.lock while running.
+	"""
+
+	def __init__(self, queue=None, lockfile=None):
+		self.queue = queue or SubmissionQueue()
+		self.lockfile = lockfile or simprodfile("submitter.lock")
+		self._lock = None
+
+	def acquire(self):
+		self._lock = open(self.lockfile, "a")
+		try:
+			fcntl.flock(self._lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			return True
+		except IOError:
+			self._lock.close()
+			self._lock = None
+			return False
+
+	def release(self):
+		if self._lock is not None:
+			fcntl.flock(self._lock.fileno(), fcntl.LOCK_UN)
+			self._lock.close()
+			self._lock = None
+
+	@staticmethod
+	def isrunning(lockfile=None):
+		lockfile = lockfile or simprodfile("submitter.lock")
+		with open(lockfile, "a") as f:
+			try:
+				fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except IOError:
+				return True
+			fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+			return False
+
+	@staticmethod
+	def start():
+		"""
+		Starts the daemon in the background if it is not running.
+		"""
+		if Submitter.isrunning():
+			return False
+
+		log = open(simprodfile("submitter.log"), "a")
+		command = [sys.executable, "-m", "simprod.simjob.utils.Submitter"]
+		subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, stdin=open(os.devnull),
+						 close_fds=True, preexec_fn=os.setsid)
+		log.close()
+		return True
+
+	def run(self, throttle):
+
+		# subjobs left by a daemon which died while sending them
+		for job, subjob in self.queue.query("SELECT job, subjob FROM queue WHERE state = 'submitting'"):
+			self.queue.requeue(job, subjob)
+
+		idle = 0
+		while idle < IDLE_TIMEOUT:
+			item = self.queue.next()
+			if item is None:
+				time.sleep(POLL_INTERVAL)
+				idle += POLL_INTERVAL
+				continue
+			idle = 0
+
+			job, subjob, options, conditions = item
+			throttle.acquire(conditions)
+			if not self.queue.take(job, subjob):
+				continue
+
+			try:
+				jobid = submit(**options)
+			except (Exception, SystemExit) as err:
+				# one bad subjob must not stop the daemon, submit.main exits on a bad command
+				print("subjob {0}.{1}: {2!r}".format(job, subjob, err))
+				jobid = None
+
+			if jobid:
+				self.queue.setstate(job, subjob, "submitted", jobid=str(jobid), fromstate="submitting")
+			else:
+				print("subjob {0}.{1} submission failed".format(job, subjob))
+				self.queue.setstate(job, subjob, "failed", fromstate="submitting")
+			sys.stdout.flush()
+
+
+if __name__ == "__main__":
+
+	# importing simprod opens the job database, the daemon does not use it
+	from simprod.simjob.simjob import DATABASE
+	DATABASE.close()
+
+	from .SlurmUtils import Throttle
+
+	submitter = Submitter()
+	throttle = Throttle()
+	while submitter.acquire():
+		print("{0}: submission daemon started (pid {1})".format(time.ctime(), os.getpid()))
+		sys.stdout.flush()
+		submitter.run(throttle)
+		submitter.release()
+		print("{0}: submission daemon stopped, the queue is empty".format(time.ctime()))
+		sys.stdout.flush()
+		# a session may have queued subjobs while the daemon was stopping, seeing it still
+		# running it did not start a new one
+		if len(submitter.queue) == 0:
+			break
@@ -4,13 +4,18 @@
 from .GetEvtType import getevttype
 from .utilities import * 
 from .Status import Status
-from .MoveJobs import Move, EosMove
+from .MoveJobs import Move, EosMove, getmover
+from .DeleteJobs import getdeleter
+from .Profiling import profiler
 from .dependencies import softimport
 import os
+import sys
 import subprocess
 import time
 
-def IsSlurm():
+BACKENDS = ["slurm", "htcondor", "lsf", "local"]
+
+def _probeslurm():
 	### Slurm
 	try:
 		P = subprocess.Popen(['squeue'], stdout=subprocess.PIPE)
@@ -20,7 +25,7 @@ def IsSlurm():
 	else:
 		return True
 		
-def IsLSF():
+def _probelsf():
 	### LSF
 	try:
 		P = subprocess.Popen(['bjobs'], stdout=subprocess.PIPE)
@@ -30,7 +35,7 @@ def IsLSF():
 	else:
 		return True
 		
-def IsHTCondor():
+def _probehtcondor():
 	### HTCondor
 	
 	command = ["which condor_q"]
@@ -48,15 +53,82 @@ def IsHTCondor():
 	else:
 		return False
 		
+def backendfile():
+	return "{0}/backend".format(os.getenv("SIMPRODPATH"))
+		
+def detectbackend():
+	"""
+	Probes the batch systems available on this machine, in order of preference.
+	"""
+	if _probeslurm():
+		return "slurm"
+	elif _probehtcondor():
+		return "htcondor"
+	elif _probelsf():
+		return "lsf"
+	else:
+		return "none"
+		
+_backend = None
+		
+def getbackend():
+	"""
+	Batch system used by simprod. It is taken, in this order, from the SIMPROD_BACKEND
+	environment variable, from the cached value, from the file SIMPRODPATH/backend or
+	detected by probing the batch systems, and then written in SIMPRODPATH/backend if one
+	was found.
+	"""
+	global _backend
+	
+	backend = os.getenv("SIMPROD_BACKEND")
+	if backend:
+		backend = backend.lower()
+		if backend not in BACKENDS + ["none"]:
+			raise ValueError("SIMPROD_BACKEND must be one of {0}!".format(BACKENDS))
+		return backend
+	
+	if _backend is None:
+		fname = backendfile()
+		if os.path.isfile(fname):
+			with open(fname, "r") as f:
+				_backend = f.read().strip()
+				
+		# "none" is not cached, the batch systems are probed again by the next session
+		if _backend not in BACKENDS:
+			_backend = detectbackend()
+			if _backend != "none":
+				try:
+					with open(fname, "w") as f:
+						f.write(_backend + "\n")
+				except IOError:
+					pass
+				
+	return _backend
+	
+def IsSlurm():
+	return getbackend() == "slurm"
+		
+def IsLSF():
+	return getbackend() == "lsf"
+		
+def IsHTCondor():
+	return getbackend() == "htcondor"
+		
+def IsLocal():
+	return getbackend() == "local"
+		
 		
 if IsSlurm():
 	from .SlurmUtils import DeliveryClerk
 	
 elif IsHTCondor():
-	from .HTCondorUtils import DeliveryClerk, Scheduler
+	from .HTCondorUtils import DeliveryClerk, Scheduler, getscheduler
 	
 elif IsLSF():
 	from .LSFUtils import DeliveryClerk
 	
+elif IsLocal():
+	from .LocalUtils import DeliveryClerk
+	
 
 
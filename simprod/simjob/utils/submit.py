@@ -15,6 +15,9 @@ import time
 import getpass
 import warnings
 
+from .Profiling import record
+from .utilities import silentrm
+
 DEBUG = 0
 
 def PrepareLSFJob(**kwargs):
@@ -44,7 +47,7 @@ def PrepareLSFJob(**kwargs):
             logdirname = "{0}/{1}/{2}".format( logdir, subdir, jobname)
             
         if os.path.exists(logdirname) and clean :
-            shutil.rmtree(logdirname, ignore_errors = True)
+            silentrm(logdirname)
         os.makedirs(logdirname) 
         
     else:
@@ -59,14 +62,15 @@ def PrepareLSFJob(**kwargs):
     return command
     
 def SendCommand(command):
-        
-    if sys.version_info[0] > 2:
-        process = sub.Popen(command, shell = True, stdout=sub.PIPE, stderr=sub.PIPE, encoding='utf8')
-    else:
-        process = sub.Popen(command, shell = True, stdout=sub.PIPE, stderr=sub.PIPE)
-        
-    time.sleep(0.03)
-    out, err = process.communicate()
+    
+    with record(command.split()[0]):
+        if sys.version_info[0] > 2:
+            process = sub.Popen(command, shell = True, stdout=sub.PIPE, stderr=sub.PIPE, encoding='utf8')
+        else:
+            process = sub.Popen(command, shell = True, stdout=sub.PIPE, stderr=sub.PIPE)
+            
+        time.sleep(0.03)
+        out, err = process.communicate()
     
     if DEBUG > 0:
         print(out)
@@ -86,6 +90,10 @@ def PrepareSlurmJob(**kwargs):
     exclude   = kwargs.get("nfreenodes", 0)       #Number of nodes to exclude (Slurm).
     nodestoexclude  = kwargs.get("nodestoexclude", [])   #Nodes to exclude (Slurm).
     dirname   = kwargs.get("dirname")
+    runfile   = kwargs.get("runfile", dirname+"/run.sh")
+    output    = kwargs.get("output", dirname+"/out")
+    error     = kwargs.get("error", dirname+"/err")
+    array     = kwargs.get("array", None)           #Indices of a job array (Slurm).
 
     def GetSlurmNodes():
         
@@ -101,20 +109,22 @@ def PrepareSlurmJob(**kwargs):
                 
         return list_nodes
         
-    oldrun = open(dirname+"/run.sh")
+    oldrun = open(runfile)
     oldrunstr = oldrun.read()
     oldrun.close()
 
-    fo = open(dirname+"/run.sh","w")
+    fo = open(runfile,"w")
     fo.write("#!/bin/bash -fx\n")                       
-    fo.write("#SBATCH -o " + dirname + "/out\n")
-    fo.write("#SBATCH -e " + dirname + "/err\n")
+    fo.write("#SBATCH -o " + output + "\n")
+    fo.write("#SBATCH -e " + error + "\n")
     fo.write("#SBATCH -J " + subdir + jobname + "\n")
     fo.write("#SBATCH --mem {0}".format(totmemory) + "\n")
     fo.write("#SBATCH --mem-per-cpu {0}".format(cpumemory) + "\n")
     fo.write("#SBATCH -n 1\n")
     fo.write("#SBATCH -p batch\n")
     fo.write("#SBATCH -t {0}:00:00\n".format(time))
+    if array is not None:
+        fo.write("#SBATCH --array={0}\n".format(array))
     if exclude != 0 or len(nodestoexclude) > 0:
         
         now = datetime.now()
@@ -154,7 +164,7 @@ def PrepareSlurmJob(**kwargs):
     fo.write(oldrunstr)
     fo.close()
     
-    command = "sbatch "+dirname+"/run.sh"
+    command = "sbatch "+runfile
     return command
 
 def main( **kwargs ):
@@ -212,7 +222,7 @@ def main( **kwargs ):
             dirname += "_"+str(run)
 
         if os.path.exists(dirname) and clean :
-            shutil.rmtree(dirname, ignore_errors = True)
+            silentrm(dirname)
         os.makedirs(dirname)
         
         kwargs['dirname'] = dirname
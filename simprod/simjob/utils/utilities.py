@@ -3,6 +3,8 @@
 import sys, os
 from subprocess import Popen, PIPE
 
+from .DeleteJobs import getdeleter
+
 # Definition of handy colours for printing
 _default    = '\x1b[00m'
 _green      = '\x1b[01;32m'
@@ -52,13 +54,10 @@ def baserunnumber():
 	return (minute + 100*hour + 10000*day + 1000000*month) * 100
 	
 def silentrm( path ):
-	
-	P = Popen(['rm','-rf',path], stdout=PIPE, stderr=PIPE)
-	_, _ = P.communicate()
-	
-	if "eos" in path and os.path.isdir(path):
-		P = Popen(['eos','rm','-rF',path], stdout=PIPE, stderr=PIPE)
-		_, _ = P.communicate()
+	"""
+	Removes path in the background, the path itself is free when it returns.
+	"""
+	getdeleter().remove(path)
 			
 # -----------------------------------------------------------------------------
 # Python 2 and 3 "conversions"